@@ -11,6 +11,9 @@ from recruit_app.app import create_app
 from recruit_app.user.models import User, Role
 from recruit_app.settings import DevConfig, ProdConfig
 from recruit_app.database import db
+import redone_search
+from recruit_app.fulltext import FullTextManager
+from recruit_app.recruit.similarity import SimilarityManager
 
 if os.environ.get("RECRUIT_APP_ENV") == 'prod':
     app = create_app(ProdConfig)
@@ -37,6 +40,42 @@ def test():
     exit_code = pytest.main([TEST_PATH, '--verbose'])
     return exit_code
 
+@manager.option('model', help='Searchable model to reindex, e.g. HrApplication')
+@manager.option('-p', '--procs', dest='procs', type=int, default=4, help='Worker processes')
+@manager.option('-i', '--incremental', dest='incremental', action='store_true', default=False,
+                help='Only reindex rows updated since the last run')
+@manager.option('-r', '--restart', dest='restart', action='store_true', default=False,
+                help='Ignore the checkpoint of an interrupted run')
+def reindex(model, procs, incremental, restart):
+    """Rebuild a model's search index, resuming an interrupted run."""
+    models = redone_search.searchable_models(app)
+    if model not in models:
+        print 'unknown model, choose from: {0}'.format(', '.join(sorted(models)))
+        return 1
+
+    def log(message):
+        print message
+
+    if incremental:
+        redone_search.reindex_incremental(app, models[model], log=log)
+    else:
+        redone_search.reindex(app, models[model], procs=procs, restart=restart, log=log)
+
+@manager.command
+def build_full_text():
+    """Rebuild the BM25 full text index."""
+    with app.app_context():
+        if not FullTextManager.available():
+            print 'full text search needs numpy and BM25_INDEX_PATH'
+            return 1
+        print 'indexed {0} documents'.format(FullTextManager.rebuild())
+
+@manager.command
+def sign_applications():
+    """Compute near duplicate signatures for applications that have none."""
+    with app.app_context():
+        print 'signed {0} applications'.format(SimilarityManager.rebuild())
+
 manager.add_command('server', Server())
 manager.add_command('shell', Shell(make_context=_make_context))
 manager.add_command('db', MigrateCommand)
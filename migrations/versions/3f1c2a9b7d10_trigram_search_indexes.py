@@ -0,0 +1,31 @@
+"""trigram search indexes
+
+Revision ID: 3f1c2a9b7d10
+Revises: None
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9b7d10'
+down_revision = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Databases built with create_all already have these, hence IF NOT EXISTS
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_characters_character_name_trgm '
+               'ON characters USING gin (character_name gin_trgm_ops)')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_hr_applications_main_character_name_trgm '
+               'ON hr_applications USING gin (main_character_name gin_trgm_ops)')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_app_characters_character_id '
+               'ON app_characters (character_id)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_app_characters_character_id')
+    op.execute('DROP INDEX IF EXISTS ix_hr_applications_main_character_name_trgm')
+    op.execute('DROP INDEX IF EXISTS ix_characters_character_name_trgm')
@@ -0,0 +1,33 @@
+"""application counters
+
+Needs PostgreSQL 9.5+, ApplicationCounterManager upserts with ON CONFLICT.
+
+Revision ID: 8a4e6d2c5b31
+Revises: 3f1c2a9b7d10
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8a4e6d2c5b31'
+down_revision = '3f1c2a9b7d10'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('hr_application_counters',
+    sa.Column('approved_denied', sa.Text(), nullable=False),
+    sa.Column('hidden', sa.Boolean(), nullable=False),
+    sa.Column('training', sa.Boolean(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('approved_denied', 'hidden', 'training')
+    )
+    op.execute("INSERT INTO hr_application_counters (approved_denied, hidden, training, count) "
+               "SELECT coalesce(approved_denied, 'New'), coalesce(hidden, false), coalesce(training, false), count(id) "
+               "FROM hr_applications GROUP BY 1, 2, 3")
+
+
+def downgrade():
+    op.drop_table('hr_application_counters')
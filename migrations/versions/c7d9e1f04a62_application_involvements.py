@@ -0,0 +1,37 @@
+"""application involvements
+
+Needs PostgreSQL 9.5+, InvolvementManager.touch upserts with ON CONFLICT.
+
+Revision ID: c7d9e1f04a62
+Revises: 8a4e6d2c5b31
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c7d9e1f04a62'
+down_revision = '8a4e6d2c5b31'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('hr_application_involvements',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('application_id', sa.Integer(), nullable=False),
+    sa.Column('last_touch', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['application_id'], ['hr_applications.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'application_id')
+    )
+    op.execute("INSERT INTO hr_application_involvements (user_id, application_id, last_touch) "
+               "SELECT user_id, application_id, coalesce(max(touched), now() at time zone 'utc') FROM ("
+               "SELECT user_id, application_id, last_update_time AS touched FROM hr_comments "
+               "UNION ALL SELECT reviewer_user_id, id, last_update_time FROM hr_applications "
+               "UNION ALL SELECT last_user_id, id, last_update_time FROM hr_applications) AS touches "
+               "WHERE user_id IS NOT NULL AND application_id IS NOT NULL GROUP BY user_id, application_id")
+
+
+def downgrade():
+    op.drop_table('hr_application_involvements')
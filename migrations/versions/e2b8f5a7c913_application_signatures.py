@@ -0,0 +1,33 @@
+"""application signatures
+
+Revision ID: e2b8f5a7c913
+Revises: c7d9e1f04a62
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e2b8f5a7c913'
+down_revision = 'c7d9e1f04a62'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    # Existing applications are signed by ``manage.py sign_applications``, it needs the Python MinHash
+    op.create_table('hr_application_signatures',
+    sa.Column('application_id', sa.Integer(), nullable=False),
+    sa.Column('signature', sa.LargeBinary(), nullable=False),
+    sa.Column('buckets', postgresql.ARRAY(sa.BigInteger()), nullable=False),
+    sa.ForeignKeyConstraint(['application_id'], ['hr_applications.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('application_id')
+    )
+    op.create_index('ix_hr_application_signatures_buckets', 'hr_application_signatures', ['buckets'],
+                    unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_hr_application_signatures_buckets', table_name='hr_application_signatures')
+    op.drop_table('hr_application_signatures')
@@ -0,0 +1,25 @@
+"""blacklist ip address index
+
+Revision ID: f4a1c8d2e7b5
+Revises: e2b8f5a7c913
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f4a1c8d2e7b5'
+down_revision = 'e2b8f5a7c913'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# BlacklistManager.find_blacklisted_ips looks entries up by exact ip_address,
+# create_all only builds this for new tables, hence IF NOT EXISTS
+def upgrade():
+    op.execute('CREATE INDEX IF NOT EXISTS ix_blacklist_character_ip_address '
+               'ON blacklist_character (ip_address)')
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_blacklist_character_ip_address')
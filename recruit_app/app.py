@@ -40,7 +40,7 @@ def create_app(config_object=ProdConfig):
     register_errorhandlers(app)
     admin = Admin()
     register_admin(admin, db)
-    # register_search(app)
+    register_search(app)
     admin.init_app(app)
     # admin needs to be initialized oddly for tests to work.
     register_tasks()
@@ -1,3 +1,3 @@
 '''The Blacklist module.'''
 
-from . import views, admin, models
+from . import views, admin, models, search
@@ -1,5 +1,6 @@
 from recruit_app.admin import AuthenticatedModelView
 from .models import BlacklistCharacter, BlacklistGSF
+from recruit_app.recruit.dossier import DossierManager
 
 def register_admin_views(admin, db):
     admin.add_view(BlacklistCharacterAdmin(BlacklistCharacter, db.session, category='BlackList'))
@@ -22,6 +23,12 @@ class BlacklistCharacterAdmin(AuthenticatedModelView):
     form_ajax_refs = {
         'creator': { 'fields': ('email', ) }, }
 
+    def after_model_change(self, form, model, is_created):
+        DossierManager.invalidate_blacklist()
+
+    def after_model_delete(self, model):
+        DossierManager.invalidate_blacklist()
+
 
 class BlacklistGSFAdmin(AuthenticatedModelView):
     column_searchable_list = (
@@ -6,6 +6,7 @@ from wtforms.validators import DataRequired, Email, EqualTo, Length, IPAddress,
 
 class SearchForm(Form):
     search = StringField('Search')
+    full_text = BooleanField('Full text')
     submit = SubmitField(label='Submit')
 
 
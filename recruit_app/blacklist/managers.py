@@ -1,5 +1,11 @@
 # -*- coding: utf-8 -*-
 from .models import BlacklistCharacter
+from recruit_app.extensions import db
+
+
+def _format_ipv4(value):
+    return '.'.join(str((value >> shift) & 0xff) for shift in (24, 16, 8, 0))
+
 
 class BlacklistManager:
     def __init__(self):
@@ -22,3 +28,41 @@ class BlacklistManager:
         except:
             return False
 
+    @staticmethod
+    def ip_lookup_keys(ip):
+        # Every blacklist value that should match this address: the address itself,
+        # each leading prefix (entries like "10.0.") and, for IPv4, its CIDR networks.
+        keys = set(ip[:end] for end in range(1, len(ip) + 1))
+
+        parts = ip.split('.')
+        if len(parts) == 4 and all(part.isdigit() and int(part) < 256 for part in parts):
+            value = 0
+            for part in parts:
+                value = (value << 8) + int(part)
+            for bits in range(33):
+                mask = (0xffffffff << (32 - bits)) & 0xffffffff
+                keys.add('{0}/{1}'.format(_format_ipv4(value & mask), bits))
+
+        return keys
+
+    @staticmethod
+    def find_blacklisted_ips(ips):
+        """Return the given addresses that hit an entry on the blacklist.
+
+        Candidate keys are generated from the addresses, so this is a single indexed
+        IN lookup on ip_address no matter how large the blacklist grows.
+        """
+        keys = {}
+        for ip in ips:
+            if ip:
+                for key in BlacklistManager.ip_lookup_keys(ip.strip()):
+                    keys.setdefault(key, set()).add(ip)
+        if not keys:
+            return []
+
+        matched = set()
+        for row in db.session.query(BlacklistCharacter.ip_address).filter(
+                BlacklistCharacter.ip_address.in_(keys.keys())).distinct():
+            matched |= keys[row.ip_address]
+
+        return sorted(matched)
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from recruit_app.database import Column, db, Model, ReferenceCol, relationship, SurrogatePK, TimeMixin
+from recruit_app.database import Column, db, Model, ReferenceCol, relationship, SurrogatePK, TimeMixin, commit_session
 from flask import current_app
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import backref
+from multiprocessing.pool import ThreadPool
 import requests
 import datetime as dt
 
@@ -16,7 +18,7 @@ class BlacklistCharacter(SurrogatePK, TimeMixin, Model):
     alliance = Column(db.Unicode)
     notes = Column(db.Unicode)
 
-    ip_address = Column(db.Unicode)
+    ip_address = Column(db.Unicode, index=True)
 
     creator_id = ReferenceCol('users', nullable=True)
     creator = relationship('User', foreign_keys=[creator_id], backref='blacklist_character_entries')
@@ -35,31 +37,71 @@ class BlacklistGSF(TimeMixin, Model):
     
     @staticmethod
     def getStatus(character):
-        try:
-            entry = BlacklistGSF.query.filter_by(character_id=character.character_id).one()
-        except:
-            # No entry, create a new one
-            entry = BlacklistGSF()
-            entry.character_id = character.character_id
-            entry.status = u'UNKNOWN'
-        
-        if entry.last_update_time is None or (dt.datetime.utcnow() - entry.last_update_time).total_seconds() > 86400: # 1 day cache
+        return BlacklistGSF.getStatuses([character])[character.character_id]
+
+    @staticmethod
+    def getStatuses(characters):
+        """Return {character_id: status} for the given characters.
+
+        Cached entries come from one query. Entries older than a day are looked up
+        on the GSF blacklist concurrently, at most GSF_BLACKLIST_WORKERS at a time
+        and each bounded by GSF_BLACKLIST_TIMEOUT, then written back in one commit.
+        """
+        characters = dict((character.character_id, character) for character in characters)
+        if not characters:
+            return {}
+
+        entries = dict((entry.character_id, entry) for entry in
+                       BlacklistGSF.query.filter(BlacklistGSF.character_id.in_(characters.keys())))
+        stale = []
+        for character_id in characters:
+            entry = entries.get(character_id)
+            if entry is None:
+                # No entry, create a new one
+                entry = BlacklistGSF()
+                entry.character_id = character_id
+                entry.status = u'UNKNOWN'
+                entries[character_id] = entry
+            if entry.last_update_time is None or (dt.datetime.utcnow() - entry.last_update_time).total_seconds() > 86400: # 1 day cache
+                stale.append(entry)
+
+        if stale:
+            url = current_app.config['GSF_BLACKLIST_URL']
+            timeout = current_app.config['GSF_BLACKLIST_TIMEOUT']
+            names = [characters[entry.character_id].character_name for entry in stale]
+            session = requests.Session()
+
+            def fetch(name):
+                try:
+                    r = session.post(url + name, timeout=timeout)
+                    return unicode(r.json()[0]['output'])
+                except: # Will except on NONE for URL, timeouts or connection issues.  Just keep the old status
+                    return None
+
+            pool = ThreadPool(min(len(stale), current_app.config['GSF_BLACKLIST_WORKERS']))
             try:
-                url = current_app.config['GSF_BLACKLIST_URL'] + character.character_name
-                r   = requests.post(url)
-                entry.status = unicode(r.json()[0]['output'])
-                entry.last_update_time = dt.datetime.utcnow()
-            except: # Will except on NONE for URL or connection issues.  Just keep status as UNKNOWN
-                pass
-            
+                results = pool.map(fetch, names)
+            finally:
+                pool.close()
+                session.close()
+
+            for entry, status in zip(stale, results):
+                if status is not None:
+                    entry.status = status
+                    entry.last_update_time = dt.datetime.utcnow()
+
             try:
-                entry.save()
-            except:
+                # A savepoint, so losing the race below only drops the new cache rows and leaves
+                # the session, and any unit of work we're called in, usable
+                with db.session.begin_nested():
+                    db.session.add_all(stale)
+            except IntegrityError:
                 # It's possible that multiple people are viewing the same new app at the same time, causing multiple threads to make the same cache object,
                 # which throws an IntegrityError.  In that case just ignore the error, this is just a cache anyway.
                 pass
+            commit_session()
 
-        return str(entry.status)
+        return dict((character_id, str(entries[character_id].status)) for character_id in characters)
 
     def __repr__(self):
         return '<BlacklistCacheEntry' + ': ' + self.character_id + '>'
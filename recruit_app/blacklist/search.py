@@ -1,4 +1,4 @@
-from flask_whooshalchemy import whoosh_index
+from redone_search import whoosh_index
 
 from models import BlacklistCharacter
 
@@ -0,0 +1,42 @@
+from recruit_app.blacklist.models import BlacklistGSF
+from recruit_app.user.models import EveCharacter, User
+from recruit_app.recruit.models import HrApplication, CLOSED_APPLICATION_STATES
+from recruit_app.recruit.dossier import DossierManager
+
+from flask_rq import job
+from flask import current_app
+
+# Characters per getStatuses call, keeps each commit and thread pool small
+BATCH_SIZE = 50
+
+
+def applicant_characters(user_ids):
+    # Same set application_view checks: current characters plus previously owned ones
+    return EveCharacter.query.filter(
+        EveCharacter.user_id.in_(user_ids) |
+        EveCharacter.previous_users.any(User.id.in_(user_ids))).all()
+
+
+def resolve_gsf_blacklist(characters):
+    for start in range(0, len(characters), BATCH_SIZE):
+        BlacklistGSF.getStatuses(characters[start:start + BATCH_SIZE])
+
+
+@job('medium')
+def prefetch_gsf_blacklist(user_id):
+    # Warm the cache as soon as someone applies so recruiters don't wait on GSF
+    with current_app.app_context():
+        resolve_gsf_blacklist(applicant_characters([user_id]))
+        DossierManager.invalidate_user(user_id)
+
+
+@job('low')
+def run_gsf_blacklist_update():
+    with current_app.app_context():
+        user_ids = [row.user_id for row in HrApplication.query.with_entities(HrApplication.user_id).filter(
+            HrApplication.hidden == False,
+            ~HrApplication.approved_denied.in_(CLOSED_APPLICATION_STATES)).distinct()]
+        if user_ids:
+            resolve_gsf_blacklist(applicant_characters(user_ids))
+            for user_id in user_ids:
+                DossierManager.invalidate_user(user_id)
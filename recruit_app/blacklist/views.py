@@ -5,6 +5,8 @@ from flask_security import current_user, roles_accepted
 from .forms import SearchForm, BlacklistCharacterForm
 from .models import BlacklistCharacter
 from .managers import BlacklistManager
+from recruit_app.recruit.dossier import DossierManager
+from recruit_app.fulltext import FullTextManager, BLACKLIST
 
 
 blueprint = Blueprint("blacklist", __name__, url_prefix='/blacklist',
@@ -25,9 +27,13 @@ def blacklist_view(page=1):
             if current_user.has_role('admin') or current_user.has_role('compliance') or current_user.has_role('blacklist'):
                 if blacklist_form.validate_on_submit():
                     if BlacklistManager.create_entry(blacklist_form, current_user):
+                        DossierManager.invalidate_blacklist()
                         flash('Entry Added')
             else:
                 flash("You don't have the proper permissions.")
+        elif search_form.validate_on_submit() and search_form.search.data and search_form.full_text.data and FullTextManager.available():
+            blacklist = FullTextManager.search_query(BlacklistCharacter, BLACKLIST, search_form.search.data)\
+                .paginate(1, current_app.config['MAX_NUMBER_PER_PAGE'], False)
         elif search_form.validate_on_submit() and search_form.search.data:
             blacklist = BlacklistCharacter.query.filter(
                 BlacklistCharacter.name.ilike       ("%" + search_form.search.data + "%")|
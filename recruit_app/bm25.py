@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""In-process BM25 full-text index.
+
+Postings are stored as flat NumPy arrays (CSR layout: one offsets array into
+doc_ids/tfs), terms as a sorted array looked up with searchsorted, so a saved
+index is a directory of .npy files that loads memory-mapped. Changes since the
+index was built go into a small in-memory delta segment that shadows the base
+versions of the same documents.
+"""
+from collections import Counter
+import json
+import os
+import re
+import shutil
+
+try:
+    import numpy
+except ImportError:  # Optional, the BM25 search is simply unavailable without it
+    numpy = None
+
+K1 = 1.2
+B = 0.75
+
+# Longer tokens are almost always pasted junk and would widen the terms array
+MAX_TOKEN_LENGTH = 32
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return [token for token in TOKEN.findall(text.lower()) if len(token) <= MAX_TOKEN_LENGTH]
+
+
+class Segment(object):
+    ARRAYS = ('terms', 'offsets', 'doc_ids', 'tfs', 'kinds', 'keys', 'lengths')
+
+    def __init__(self, terms, offsets, doc_ids, tfs, kinds, keys, lengths):
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.kinds = kinds
+        self.keys = keys
+        self.lengths = lengths
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def build(cls, documents):
+        """Index an iterable of (kind, key, text) documents."""
+        return cls.from_tokens((kind, key, tokenize(text)) for kind, key, text in documents)
+
+    @classmethod
+    def from_tokens(cls, documents):
+        """Index an iterable of already tokenized (kind, key, tokens) documents."""
+        postings = {}
+        kinds, keys, lengths = [], [], []
+        for doc, (kind, key, tokens) in enumerate(documents):
+            kinds.append(kind)
+            keys.append(key)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).iteritems():
+                postings.setdefault(term, []).append((doc, tf))
+
+        terms = sorted(postings)
+        offsets = numpy.zeros(len(terms) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum([len(postings[term]) for term in terms], dtype=numpy.int64)
+        doc_ids = numpy.empty(offsets[-1], dtype=numpy.int32)
+        tfs = numpy.empty(offsets[-1], dtype=numpy.float32)
+        for i, term in enumerate(terms):
+            docs, counts = zip(*postings[term])
+            doc_ids[offsets[i]:offsets[i + 1]] = docs
+            tfs[offsets[i]:offsets[i + 1]] = counts
+
+        return cls(numpy.array(terms or [u''], dtype='U')[:len(terms)],
+                   offsets,
+                   doc_ids,
+                   tfs,
+                   numpy.array(kinds, dtype=numpy.int8),
+                   numpy.array(keys, dtype=numpy.int64),
+                   numpy.array(lengths, dtype=numpy.float32))
+
+    def save(self, path):
+        for name in self.ARRAYS:
+            numpy.save(os.path.join(path, name + '.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, path):
+        return cls(**dict((name, numpy.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+                          for name in cls.ARRAYS))
+
+    def span(self, term):
+        i = numpy.searchsorted(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return self.offsets[i], self.offsets[i + 1]
+        return 0, 0
+
+
+class BM25Index(object):
+    """A base segment, usually memory-mapped, plus an in-memory delta segment."""
+
+    def __init__(self, base, watermark=None):
+        self.base = base
+        self.watermark = watermark
+        self.changed = {}
+        self.update([])
+
+    def update(self, documents):
+        """Add documents changed since the last update to the delta, replacing older versions.
+
+        Only the new documents are tokenized, the delta keeps the tokens of earlier ones.
+        Not safe to call from two threads at once, searches can run alongside it.
+        """
+        changed = dict(self.changed)
+        for kind, key, text in documents:
+            changed[(kind, key)] = tokenize(text)
+        delta = Segment.from_tokens((kind, key, tokens) for (kind, key), tokens in changed.iteritems())
+
+        live = numpy.ones(len(self.base), dtype=bool)
+        for kind in numpy.unique(delta.kinds):
+            keys = delta.keys[delta.kinds == kind]
+            live &= ~((self.base.kinds == kind) & numpy.isin(self.base.keys, keys))
+        self.changed = changed
+        # One assignment, so a concurrent search never pairs the new delta with the old mask
+        self.segments = [(self.base, live), (delta, None)]
+
+    def search(self, text, limit=50, kind=None):
+        """Return up to limit (kind, key, score) tuples, best first."""
+        terms = set(tokenize(text))
+        if not terms:
+            return []
+
+        segments = self.segments
+        (base, live), (delta, _) = segments
+        count = int(live.sum()) + len(delta)
+        if not count:
+            return []
+        avgdl = (float(base.lengths[live].sum()) + float(delta.lengths.sum())) / count or 1.0
+
+        spans = dict((term, [segment.span(term) for segment, _ in segments]) for term in terms)
+        idfs = {}
+        for term, term_spans in spans.iteritems():
+            df = sum(stop - start for start, stop in term_spans)
+            idfs[term] = numpy.log(1.0 + (count - df + 0.5) / (df + 0.5))
+
+        results = []
+        for number, (segment, live) in enumerate(segments):
+            if not len(segment):
+                continue
+            scores = numpy.zeros(len(segment), dtype=numpy.float32)
+            norm = K1 * (1.0 - B + B * segment.lengths / avgdl)
+            for term in terms:
+                start, stop = spans[term][number]
+                if start == stop:
+                    continue
+                docs = segment.doc_ids[start:stop]
+                tfs = segment.tfs[start:stop]
+                # Doc ids are unique within one term's postings, so plain fancy indexing adds up
+                scores[docs] += idfs[term] * tfs * (K1 + 1.0) / (tfs + norm[docs])
+
+            if live is not None:
+                scores[~live] = 0
+            if kind is not None:
+                scores[segment.kinds != kind] = 0
+
+            hits = numpy.flatnonzero(scores > 0)
+            if len(hits) > limit:
+                hits = hits[numpy.argpartition(-scores[hits], limit)[:limit]]
+            results.extend((int(segment.kinds[doc]), int(segment.keys[doc]), float(scores[doc])) for doc in hits)
+
+        results.sort(key=lambda result: -result[2])
+        return results[:limit]
+
+    def save(self, path):
+        """Write the base segment to path, replacing any index already there."""
+        staging = path + '.new'
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+        os.makedirs(staging)
+        self.base.save(staging)
+        with open(os.path.join(staging, 'meta.json'), 'w') as f:
+            json.dump({'watermark': self.watermark}, f)
+
+        previous = path + '.old'
+        if os.path.exists(path):
+            os.rename(path, previous)
+        os.rename(staging, path)
+        shutil.rmtree(previous, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        return cls(Segment.load(path), meta['watermark'])
@@ -1,8 +1,14 @@
 """Database module, including the SQLAlchemy database object and DB-related
 utilities.
 """
+from flask import current_app
+from sqlalchemy import event, DDL, and_, or_
 from sqlalchemy.orm import relationship
+from functools import wraps
 import datetime
+import base64
+import json
+import numbers
 
 from .extensions import db
 from .compat import basestring
@@ -10,6 +16,182 @@ from .compat import basestring
 # Alias common SQLAlchemy names
 Column = db.Column
 
+# Trigram indexes need the extension in place before their tables are created
+event.listen(db.metadata, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+
+def trigram_index(name, column):
+    """GIN trigram index on a text column, serves ``ilike('%term%')`` and ``similarity()``."""
+    return db.Index(name, column, postgresql_using='gin', postgresql_ops={column.name: 'gin_trgm_ops'})
+
+
+class unit_of_work(object):
+    """Context manager and decorator that batches every commit inside it into one.
+
+    ``save()``, ``delete()`` and :func:`commit_session` only flush while a unit of work is
+    open, so primary keys are still assigned. The outermost block commits once on
+    exit, or rolls everything back if an exception escapes. Nested blocks join
+    the outer one.
+
+    Usage: ::
+
+        with unit_of_work():
+            comment.save()
+            application.save()
+
+        @unit_of_work()
+        def create_things(): ...
+    """
+
+    def __enter__(self):
+        info = db.session().info
+        info['unit_of_work_depth'] = info.get('unit_of_work_depth', 0) + 1
+        return db.session
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        info = db.session().info
+        info['unit_of_work_depth'] -= 1
+        if info['unit_of_work_depth'] == 0:
+            callbacks = info.pop('unit_of_work_after_commit', [])
+            if exc_type is None:
+                try:
+                    db.session.commit()
+                except:
+                    db.session.rollback()
+                    raise
+                for callback in callbacks:
+                    # The work is committed, a failing side effect shouldn't fail it or skip the rest
+                    try:
+                        callback()
+                    except Exception:
+                        current_app.logger.exception('after_commit callback failed')
+            else:
+                db.session.rollback()
+        return False
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with unit_of_work():
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def in_unit_of_work():
+    return db.session().info.get('unit_of_work_depth', 0) > 0
+
+
+def after_commit(callback):
+    """Run callback once the open unit of work commits, or right away outside one.
+
+    Meant for side effects like notifications and cache invalidation, which must not
+    see rows that are later rolled back. Callbacks are dropped on rollback, and one
+    raising is logged without stopping the others.
+    """
+    if in_unit_of_work():
+        db.session().info.setdefault('unit_of_work_after_commit', []).append(callback)
+    else:
+        callback()
+
+
+def commit_session():
+    """Commit the session, or just flush it while a unit of work is open."""
+    if in_unit_of_work():
+        db.session.flush()
+        return
+    try:
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(list(values)))
+
+
+def decode_cursor(token, keys):
+    """Key values from a cursor token, or None if there's no usable token.
+
+    Tokens come from the query string, so every value is checked against the type of
+    its key column before it gets anywhere near SQL.
+    """
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(token)))
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != len(keys):
+        return None
+    for value, (expression, _) in zip(values, keys):
+        if not _cursor_value_matches(value, expression):
+            return None
+    return values
+
+
+def _cursor_value_matches(value, expression):
+    try:
+        python_type = expression.type.python_type
+    except NotImplementedError:
+        return isinstance(value, (bool, numbers.Number, basestring))
+    if python_type is bool:
+        return isinstance(value, bool)
+    if issubclass(python_type, numbers.Integral):
+        return isinstance(value, numbers.Integral) and not isinstance(value, bool)
+    if issubclass(python_type, basestring):
+        return isinstance(value, basestring)
+    return False
+
+
+class KeysetPagination(object):
+    """A page of a query found by seeking past a sort key instead of OFFSET.
+
+    ``keys`` is a list of ``(expression, descending)`` pairs that together order rows
+    uniquely and ``values`` maps an item to its tuple of key values. Pages are
+    addressed with ``after``/``before`` cursor tokens, so any page costs the same
+    index range scan as the first one. ``total`` is whatever count the caller
+    has to hand, usually a cached one, and is only displayed.
+    """
+
+    def __init__(self, query, keys, values, per_page, after=None, before=None, total=None):
+        backwards = bool(before) and not after
+        cursor = decode_cursor(before if backwards else after, keys)
+        if cursor is None:
+            backwards = False
+        else:
+            query = query.filter(self._seek(keys, cursor, backwards))
+
+        order = [expression.desc() if descending != backwards else expression.asc()
+                 for expression, descending in keys]
+        items = query.order_by(None).order_by(*order).limit(per_page + 1).all()
+
+        more = len(items) > per_page
+        items = items[:per_page]
+        if backwards:
+            items.reverse()
+
+        self.items = items
+        self.per_page = per_page
+        self.total = total
+        self.has_next = True if backwards else more
+        self.has_prev = more if backwards else cursor is not None
+        self.next_cursor = encode_cursor(values(items[-1])) if self.has_next and items else None
+        self.prev_cursor = encode_cursor(values(items[0])) if self.has_prev and items else None
+
+    @staticmethod
+    def _seek(keys, cursor, backwards):
+        # Row-value comparison spelled out, since the key directions can differ
+        clauses = []
+        for i, (expression, descending) in enumerate(keys):
+            if descending != backwards:
+                beyond = expression < cursor[i]
+            else:
+                beyond = expression > cursor[i]
+            clauses.append(and_(*[keys[j][0] == cursor[j] for j in range(i)] + [beyond]))
+        return or_(*clauses)
+
 
 class CRUDMixin(object):
     """Mixin that adds convenience methods for CRUD (create, read, update, delete)
@@ -32,22 +214,14 @@ class CRUDMixin(object):
         """Save the record."""
         db.session.add(self)
         if commit:
-            try:
-                db.session.commit()
-            except:
-                db.session.rollback()
-                raise
+            commit_session()
         return self
 
     def delete(self, commit=True):
         """Remove the record from the database."""
         db.session.delete(self)
         if commit:
-            try:
-                return db.session.commit()
-            except:
-                db.session.rollback()
-                raise
+            return commit_session()
 
         return False
 
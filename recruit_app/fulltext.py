@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from recruit_app.bm25 import BM25Index, Segment, numpy
+from recruit_app.user.models import EveCharacter
+from recruit_app.recruit.models import HrApplication, character_apps
+from recruit_app.blacklist.models import BlacklistCharacter
+from recruit_app.extensions import db
+
+from flask import current_app
+from sqlalchemy import func, false, or_, select
+from sqlalchemy.dialects import postgresql
+
+import datetime as dt
+import os
+import threading
+import time
+
+APPLICATION = 0
+BLACKLIST = 1
+
+BLACKLIST_FIELDS = ['name', 'main_name', 'corporation', 'alliance', 'notes']
+WATERMARK_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# One engine per process, shared by its threads
+_engine = {'index': None, 'mtime': None, 'since': None, 'refreshed': 0, 'refreshing': False}
+_lock = threading.Lock()
+
+
+class FullTextManager(object):
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def available():
+        return numpy is not None and bool(current_app.config.get('BM25_INDEX_PATH'))
+
+    @staticmethod
+    def documents(since=None):
+        """Yield (kind, key, text) for applications and blacklist entries changed since the given time."""
+        applications = db.session.query(HrApplication.id, *[getattr(HrApplication, field) for field in HrApplication.__searchable__])
+        characters = db.session.query(character_apps.c.app_id, EveCharacter.character_name)\
+            .join(EveCharacter, EveCharacter.character_id == character_apps.c.character_id)
+        blacklist = db.session.query(BlacklistCharacter.id, *[getattr(BlacklistCharacter, field) for field in BLACKLIST_FIELDS])
+        if since is not None:
+            # Renaming an applied character changes the application's text as well
+            renamed = select([character_apps.c.app_id]).select_from(character_apps.join(
+                EveCharacter, EveCharacter.character_id == character_apps.c.character_id)).where(
+                EveCharacter.last_update_time >= since)
+            changed = or_(HrApplication.last_update_time >= since, HrApplication.id.in_(renamed))
+            applications = applications.filter(changed)
+            characters = characters.join(HrApplication, HrApplication.id == character_apps.c.app_id)\
+                .filter(changed)
+            blacklist = blacklist.filter(BlacklistCharacter.last_update_time >= since)
+
+        names = {}
+        for app_id, character_name in characters:
+            names.setdefault(app_id, []).append(character_name or u'')
+
+        for row in applications.yield_per(1000):
+            yield APPLICATION, row[0], u' '.join([value or u'' for value in row[1:]] + names.get(row[0], []))
+        for row in blacklist.yield_per(1000):
+            yield BLACKLIST, row[0], u' '.join(value or u'' for value in row[1:])
+
+    @staticmethod
+    def rebuild():
+        """Build the index from scratch and replace the one on disk."""
+        # Taken before reading so rows changed during the build land in the next delta
+        watermark = dt.datetime.utcnow()
+        index = BM25Index(Segment.build(FullTextManager.documents()), watermark.strftime(WATERMARK_FORMAT))
+        index.save(current_app.config['BM25_INDEX_PATH'])
+        return len(index.base)
+
+    @staticmethod
+    def index():
+        """Return this process's engine, reloading a rebuilt index and refreshing the delta when due."""
+        path = current_app.config['BM25_INDEX_PATH']
+        meta = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta):
+            return None
+
+        with _lock:
+            mtime = os.path.getmtime(meta)
+            if _engine['mtime'] != mtime:
+                _engine['index'] = BM25Index.load(path)
+                _engine['mtime'] = mtime
+                _engine['since'] = dt.datetime.strptime(_engine['index'].watermark, WATERMARK_FORMAT)
+                _engine['refreshed'] = 0
+
+            index = _engine['index']
+            since = _engine['since']
+            # One thread claims the refresh, the others keep searching the current delta
+            refresh = not _engine['refreshing'] and \
+                time.time() - _engine['refreshed'] > current_app.config['BM25_REFRESH_INTERVAL']
+            if refresh:
+                _engine['refreshing'] = True
+
+        if refresh:
+            try:
+                # Taken before reading, rows changed during the query are read again next time
+                started = dt.datetime.utcnow()
+                index.update(list(FullTextManager.documents(since)))
+                with _lock:
+                    if _engine['index'] is index:
+                        _engine['since'] = started
+            finally:
+                with _lock:
+                    _engine['refreshed'] = time.time()
+                    _engine['refreshing'] = False
+        return index
+
+    @staticmethod
+    def search(text, kind, limit=200):
+        """Return the keys of the best matching documents of one kind, best first."""
+        index = FullTextManager.index()
+        if index is None:
+            return []
+        return [key for _, key, _ in index.search(text, limit=limit, kind=kind)]
+
+    @staticmethod
+    def search_query(model, kind, text):
+        """A query for model rows matching text, in BM25 rank order."""
+        ranked = FullTextManager.search(text, kind)
+        if not ranked:
+            return model.query.filter(false())
+        return model.query.filter(model.id.in_(ranked))\
+            .order_by(func.array_position(postgresql.array(ranked), model.id))
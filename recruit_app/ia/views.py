@@ -3,7 +3,7 @@ from flask_security.decorators import login_required
 from flask_security import current_user
 
 from recruit_app.ia.managers import IaManager
-from recruit_app.user.eve_api_manager import EveApiManager
+from recruit_app.user.affiliation_manager import AffiliationManager
 
 from recruit_app.ia.forms import SubmitIssueForm
 
@@ -13,7 +13,7 @@ blueprint = Blueprint("ia", __name__, url_prefix='/ia', static_folder="../static
 @login_required
 def submit_issue():
     # Check if user is in Karmafleet (98370861)
-    if not EveApiManager.check_if_character_is_in_corp(int(current_user.main_character_id), 98370861):
+    if not AffiliationManager.check_if_character_is_in_corp(int(current_user.main_character_id), 98370861):
         flash('You are not a current KarmaFleet member.', 'error')
         return redirect(url_for('public.home'))
         
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, current_app, flash, redirect, url_for
 from flask_security.decorators import login_required
 from flask_security import roles_accepted, current_user
-from recruit_app.user.eve_api_manager import EveApiManager
+from recruit_app.user.affiliation_manager import AffiliationManager
 from recruit_app.user.models import EveApiKeyPair
 from flask import Response
 from flask import stream_with_context
@@ -29,7 +29,7 @@ def jackknife_proxy():
     if 'chid' in request.args and not (current_user.has_role("restricted_api_view") or current_user.has_role("admin")):
         chid = request.values['chid']
         
-        if EveApiManager.check_if_character_is_in_alliance(int(chid), 1354830081):
+        if AffiliationManager.check_if_character_is_in_alliance(int(chid), 1354830081):
             return 'Insufficient permissions to view KarmaFleet character page.'
         
     url = current_app.config['JACK_KNIFE_URL'] + '?' + request.query_string + '&apik=' + api_key
@@ -1,4 +1,4 @@
 '''The recruit module.'''
 
 from . import views, admin
-# from . import search
+from . import search
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from recruit_app.recruit.models import HrApplication, HrApplicationCounter, CLOSED_APPLICATION_STATES
+from recruit_app.extensions import db
+
+from sqlalchemy import func, text
+
+# Postgres upsert, the counter row for a new status appears on first use
+ADJUST = text('INSERT INTO hr_application_counters (approved_denied, hidden, training, count) '
+              'VALUES (:approved_denied, :hidden, :training, :delta) '
+              'ON CONFLICT (approved_denied, hidden, training) '
+              'DO UPDATE SET count = hr_application_counters.count + :delta')
+
+
+class ApplicationCounterManager:
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def key(application):
+        # Mirrors the column defaults, a new application isn't flushed yet
+        return (application.approved_denied or 'New', bool(application.hidden), bool(application.training))
+
+    @staticmethod
+    def adjust(key, delta):
+        """Add delta to a counter in the current transaction."""
+        approved_denied, hidden, training = key
+        db.session.execute(ADJUST, {'approved_denied': approved_denied, 'hidden': hidden,
+                                    'training': training, 'delta': delta})
+
+    @staticmethod
+    def move(old_key, new_key):
+        if old_key != new_key:
+            ApplicationCounterManager.adjust(old_key, -1)
+            ApplicationCounterManager.adjust(new_key, 1)
+
+    @staticmethod
+    def status_counts(hidden=False):
+        counts = {}
+        for row in HrApplicationCounter.query.filter_by(hidden=hidden):
+            counts[row.approved_denied] = counts.get(row.approved_denied, 0) + row.count
+        return counts
+
+    @staticmethod
+    def training_count():
+        return db.session.query(func.coalesce(func.sum(HrApplicationCounter.count), 0)).filter(
+            HrApplicationCounter.hidden == False,
+            HrApplicationCounter.training == True,
+            ~HrApplicationCounter.approved_denied.in_(CLOSED_APPLICATION_STATES)).scalar()
+
+    @staticmethod
+    def open_count():
+        counts = ApplicationCounterManager.status_counts()
+        return sum(count for status, count in counts.iteritems() if status not in CLOSED_APPLICATION_STATES)
+
+    @staticmethod
+    def visible_count():
+        return sum(ApplicationCounterManager.status_counts().itervalues())
+
+    @staticmethod
+    def reconcile():
+        """Rebuild every counter from hr_applications, repairing any drift.
+
+        The counter table is locked for the rebuild so adjustments made meanwhile
+        wait and land on top of the fresh numbers.
+        """
+        db.session.execute('LOCK TABLE hr_application_counters IN EXCLUSIVE MODE')
+        db.session.query(HrApplicationCounter).delete(synchronize_session=False)
+        key = (func.coalesce(HrApplication.approved_denied, 'New'),
+               func.coalesce(HrApplication.hidden, False),
+               func.coalesce(HrApplication.training, False))
+        rows = db.session.query(*(key + (func.count(HrApplication.id),))).group_by(*key).all()
+        if rows:
+            db.session.bulk_insert_mappings(HrApplicationCounter, [
+                {'approved_denied': approved_denied, 'hidden': hidden, 'training': training, 'count': count}
+                for approved_denied, hidden, training, count in rows])
+        db.session.commit()
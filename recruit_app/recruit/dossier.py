@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+from recruit_app.user.models import EveCharacter, EveCorporationInfo, EveApiKeyPair, User
+from recruit_app.recruit.models import HrApplication, HrApplicationComment, character_apps
+from recruit_app.blacklist.models import BlacklistCharacter, BlacklistGSF
+from recruit_app.blacklist.managers import BlacklistManager
+from recruit_app.extensions import db
+from recruit_app.database import after_commit
+
+from flask import current_app
+from flask_rq import get_connection
+from redis import RedisError
+from sqlalchemy import asc
+from sqlalchemy.orm import joinedload
+
+import cPickle as pickle
+
+# Dossiers are cached per application under the applicant's and the blacklist's
+# version counters, so bumping either one orphans every dossier built on old data.
+USER_VERSION_KEY = 'dossier:version:user:{0}'
+BLACKLIST_VERSION_KEY = 'dossier:version:blacklist'
+DOSSIER_KEY = 'dossier:{0}:{1}:{2}'
+
+
+class DossierManager:
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def connection():
+        return get_connection()
+
+    @staticmethod
+    def get_dossier(application):
+        """Return the recruiter dossier for an application, building it on a cache miss.
+
+        The dossier holds everything application_view shows recruiters besides the
+        application itself: characters with their corp, alliance and GSF status,
+        related applications, comments, api keys and the blacklist results.
+        """
+        try:
+            conn = DossierManager.connection()
+            user_version, blacklist_version = conn.mget(
+                [USER_VERSION_KEY.format(application.user_id), BLACKLIST_VERSION_KEY])
+            key = DOSSIER_KEY.format(application.id, user_version or 0, blacklist_version or 0)
+            cached = conn.get(key)
+            if cached is not None:
+                return pickle.loads(cached)
+        except RedisError as error:
+            current_app.logger.warning(error)
+            return DossierManager.build(application)
+
+        dossier = DossierManager.build(application)
+        try:
+            conn.set(key, pickle.dumps(dossier, pickle.HIGHEST_PROTOCOL), ex=current_app.config['DOSSIER_TTL'])
+        except RedisError as error:
+            current_app.logger.warning(error)
+
+        return dossier
+
+    @staticmethod
+    def invalidate_user(user_id):
+        # Comments, status changes, characters and api keys all hang off the applicant
+        DossierManager._bump(USER_VERSION_KEY.format(user_id))
+
+    @staticmethod
+    def invalidate_blacklist():
+        DossierManager._bump(BLACKLIST_VERSION_KEY)
+
+    @staticmethod
+    def _bump(key):
+        # Bumping before the commit would let a concurrent view cache the old rows
+        # under the new version, so inside a unit of work this waits for the commit
+        after_commit(lambda: DossierManager._incr(key))
+
+    @staticmethod
+    def _incr(key):
+        try:
+            DossierManager.connection().incr(key)
+        except RedisError as error:
+            current_app.logger.warning(error)
+
+    @staticmethod
+    def build(application):
+        # Every relationship the page walks is loaded up front, so the number of
+        # queries stays fixed however many characters, comments and apps there are
+        query = EveCharacter.query.options(
+            joinedload(EveCharacter.corporation).joinedload(EveCorporationInfo.alliance))
+        characters = query.filter_by(user_id=application.user_id).order_by(EveCharacter.api_id).all()
+        characters += query.filter(EveCharacter.previous_users.any(id=application.user_id)).all()
+
+        # Get related applications
+        related = HrApplication.query.filter(HrApplication.user_id == application.user_id, HrApplication.id != application.id).order_by(HrApplication.id).all()
+        related_characters = dict((app.id, []) for app in related)
+        if related:
+            for app_id, character_name in db.session.query(character_apps.c.app_id, EveCharacter.character_name).join(
+                    EveCharacter, EveCharacter.character_id == character_apps.c.character_id).filter(
+                    character_apps.c.app_id.in_(related_characters.keys())):
+                related_characters[app_id].append({'character_name': character_name})
+
+        comments = HrApplicationComment.query.filter_by(
+            application_id=application.id)\
+            .options(joinedload(HrApplicationComment.user).joinedload(User.main_character))\
+            .order_by(asc(HrApplicationComment.created_time))\
+            .all()
+
+        api_keys = EveApiKeyPair.query.filter_by(user_id=application.user_id).all()
+
+        gsf_statuses = BlacklistGSF.getStatuses(characters)
+        names = [character.character_name for character in characters]
+        matches = BlacklistCharacter.query.filter(BlacklistCharacter.name.in_(names)).all() if names else []
+
+        return {
+            'characters': [DossierManager._character(character) for character in characters],
+            'evewho': dict((name, name.replace(' ', '+')) for name in names),
+            'gsf_blacklist': dict((character.character_name, gsf_statuses[character.character_id]) for character in characters),
+            'gsf_flagged': [character.character_name for character in characters
+                            if gsf_statuses[character.character_id] not in ('NOT FOUND', 'CLEARED')],
+            'blacklisted_ips': BlacklistManager.find_blacklisted_ips(application.user.get_ips),
+            'blacklist_matches': str(matches) if matches else '',
+            'related': [{'id': app.id,
+                         'approved_denied': app.approved_denied,
+                         'characters': related_characters[app.id]}
+                        for app in related],
+            'comments': [{'id': comment.id,
+                          'user_id': comment.user_id,
+                          'user': {'main_character': unicode(comment.user.main_character)}
+                                  if comment.user and comment.user.main_character else None,
+                          'comment': comment.comment,
+                          'created_time': comment.created_time,
+                          'last_update_time': comment.last_update_time}
+                         for comment in comments],
+            'api_keys': [{'api_id': api_key.api_id, 'last_update_time': api_key.last_update_time}
+                         for api_key in api_keys],
+        }
+
+    @staticmethod
+    def _character(character):
+        # Plain dicts keep the attribute paths application.html already uses
+        corporation = character.corporation
+        return {
+            'character_id': character.character_id,
+            'character_name': character.character_name,
+            'user_id': character.user_id,
+            'api_id': character.api_id,
+            'api': {'api_id': character.api_id} if character.api_id else None,
+            'corporation': {
+                'corporation_name': corporation.corporation_name,
+                'corporation_ticker': corporation.corporation_ticker,
+                'alliance': {'alliance_name': corporation.alliance.alliance_name} if corporation.alliance else None,
+            } if corporation else None,
+        }
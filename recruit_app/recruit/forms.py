@@ -82,4 +82,5 @@ class HrApplicationCommentEdit(Form):
 
 class SearchForm(Form):
     search = StringField('Search')
+    full_text = BooleanField('Full text')
     submit = SubmitField(label='Submit')
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from recruit_app.recruit.models import HrApplication, HrApplicationComment, HrApplicationInvolvement
+from recruit_app.extensions import db
+
+from sqlalchemy import func, text, union_all
+
+import datetime as dt
+
+TOUCH = text('INSERT INTO hr_application_involvements (user_id, application_id, last_touch) '
+             'VALUES (:user_id, :application_id, :last_touch) '
+             'ON CONFLICT (user_id, application_id) '
+             'DO UPDATE SET last_touch = greatest(hr_application_involvements.last_touch, excluded.last_touch)')
+
+
+class InvolvementManager:
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def touch(user_id, application_id):
+        """Record in the current transaction that a user worked on an application."""
+        if user_id and application_id:
+            db.session.execute(TOUCH, {'user_id': user_id, 'application_id': application_id,
+                                       'last_touch': dt.datetime.utcnow()})
+
+    @staticmethod
+    def applications_query(user_id):
+        return HrApplication.query.join(
+            HrApplicationInvolvement, HrApplicationInvolvement.application_id == HrApplication.id).filter(
+            HrApplicationInvolvement.user_id == user_id)
+
+    @staticmethod
+    def rebuild():
+        """Backfill the index from comments and the reviewer and last action users.
+
+        Only ever adds or moves last_touch forward, going through the same upsert as
+        touch(). Actions the applications no longer record, e.g. a training toggle or
+        an earlier recruiter's status change, live only in the index and must survive.
+        """
+        touches = union_all(
+            db.session.query(HrApplicationComment.user_id, HrApplicationComment.application_id,
+                             HrApplicationComment.last_update_time),
+            db.session.query(HrApplication.reviewer_user_id, HrApplication.id, HrApplication.last_update_time),
+            db.session.query(HrApplication.last_user_id, HrApplication.id, HrApplication.last_update_time)).alias('touches')
+        user_id, application_id, touched = touches.c
+        rows = db.session.query(user_id, application_id, func.max(touched)).filter(
+            user_id != None, application_id != None).group_by(user_id, application_id).all()
+
+        if rows:
+            db.session.execute(TOUCH, [
+                {'user_id': user, 'application_id': application, 'last_touch': last_touch or dt.datetime.utcnow()}
+                for user, application, last_touch in rows])
+        db.session.commit()
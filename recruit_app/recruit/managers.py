@@ -1,12 +1,23 @@
 # -*- coding: utf-8 -*-
-from recruit_app.user.models import EveCharacter
-
-from recruit_app.recruit.models import HrApplication, HrApplicationComment, HrApplicationCommentHistory
+from recruit_app.user.models import EveCharacter, EveApiKeyPair
+from recruit_app.user.refresh_queue import ApiKeyRefreshQueue
+from recruit_app.blacklist.tasks import prefetch_gsf_blacklist
+
+from recruit_app.recruit.models import HrApplication, HrApplicationComment, HrApplicationCommentHistory, character_apps
+from recruit_app.recruit.dossier import DossierManager
+from recruit_app.recruit.counters import ApplicationCounterManager
+from recruit_app.recruit.involvement import InvolvementManager
+from recruit_app.recruit.tasks import sign_application
+from recruit_app.recruit.slack import SlackManager
+from recruit_app.database import unit_of_work, after_commit
+from recruit_app.extensions import db
 
 import datetime as dt
+from itertools import groupby
 
 from flask import current_app, url_for
-import requests
+from redis import RedisError
+from sqlalchemy import func, union_all
 import re
 
 class RecruitManager:
@@ -22,34 +33,73 @@ class RecruitManager:
 
         return False
 
+    @staticmethod
+    def search_applications(term):
+        """Applications whose main, applicant characters or applied characters match term.
+
+        Every branch filters with ilike on a trigram indexed column, and results are
+        ranked by their best trigram similarity to the term.
+        """
+        term = unicode(term)
+        pattern = u'%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + u'%'
+
+        by_main = db.session.query(
+            HrApplication.id.label('app_id'),
+            func.similarity(HrApplication.main_character_name, term).label('rank')).filter(
+            HrApplication.main_character_name.ilike(pattern, escape='\\'))
+        by_applicant = db.session.query(
+            HrApplication.id,
+            func.similarity(EveCharacter.character_name, term)).join(
+            EveCharacter, EveCharacter.user_id == HrApplication.user_id).filter(
+            EveCharacter.character_name.ilike(pattern, escape='\\'))
+        by_applied = db.session.query(
+            character_apps.c.app_id,
+            func.similarity(EveCharacter.character_name, term)).join(
+            EveCharacter, EveCharacter.character_id == character_apps.c.character_id).filter(
+            EveCharacter.character_name.ilike(pattern, escape='\\'))
+
+        matches = union_all(by_main, by_applicant, by_applied).alias('matches')
+        ranked = db.session.query(
+            matches.c.app_id,
+            func.max(matches.c.rank).label('rank')).group_by(matches.c.app_id).subquery()
+
+        return HrApplication.query.join(ranked, ranked.c.app_id == HrApplication.id).order_by(
+            ranked.c.rank.desc(), HrApplication.id)
+
     @staticmethod
     def create_comment(application, comment_data, user):
-        comment = HrApplicationComment()
-        comment.application_id = application.id
-        comment.comment = comment_data
-        if user:
-            comment.user_id = user.id
-        comment.save()
-        application.last_update_time = dt.datetime.utcnow()
-        application.save()
+        with unit_of_work():
+            comment = HrApplicationComment()
+            comment.application_id = application.id
+            comment.comment = comment_data
+            if user:
+                comment.user_id = user.id
+                InvolvementManager.touch(user.id, application.id)
+            comment.save()
+            application.last_update_time = dt.datetime.utcnow()
+            application.save()
+        DossierManager.invalidate_user(application.user_id)
         RecruitManager.comment_notify(comment)
 
     @staticmethod
     def edit_comment(comment, comment_data, user):
-        # Save the previous version of the comment for possible future use / auditing
-        comment_history = HrApplicationCommentHistory()
-        comment_history.old_comment = comment.comment
-        comment_history.comment_id = comment.id
-        comment_history.editor = user
-        comment_history.save()
-
-        # Save the edit
-        comment.comment = comment_data
-        comment.last_update_time = dt.datetime.utcnow()
-#        if not comment.user_id:
-#            comment.user = user
-        comment.application.last_update_time = dt.datetime.utcnow()
-        comment.save()
+        with unit_of_work():
+            # Save the previous version of the comment for possible future use / auditing
+            comment_history = HrApplicationCommentHistory()
+            comment_history.old_comment = comment.comment
+            comment_history.comment_id = comment.id
+            comment_history.editor = user.id
+            comment_history.save()
+
+            # Save the edit
+            comment.comment = comment_data
+            comment.last_update_time = dt.datetime.utcnow()
+#            if not comment.user_id:
+#                comment.user = user
+            comment.application.last_update_time = dt.datetime.utcnow()
+            comment.save()
+            InvolvementManager.touch(user.id, comment.application_id)
+        DossierManager.invalidate_user(comment.application.user_id)
         RecruitManager.comment_notify(comment)
 
     @staticmethod
@@ -77,121 +127,167 @@ class RecruitManager:
         application.hidden = False
         application.user_id = user.id
 
-        for character in form.characters.data:
-                # The form data for characters selected is the character id
-                eve_character = EveCharacter.query.filter_by(character_id=character).first()
-                application.characters.append(eve_character)
+        # The form data for characters selected is the character id
+        if form.characters.data:
+            application.characters.extend(
+                EveCharacter.query.filter(EveCharacter.character_id.in_(form.characters.data)).all())
 
         application.main_character_name = user.main_character.character_name
-        # application.last_update_time = dt.datetime.utcnow()
+        application.created_time = dt.datetime.utcnow()
 
-        application.save()
-        RecruitManager.application_action_notify(application, 'new')
-        
-        # Create a starter comment
+        # Create a starter comment, every key and its characters in one query
         comment_text = "#### Accounts as of " + application.created_time.strftime('%Y/%m/%d %H:%M') + ":\n"
-        for api_key in application.user.api_keys:
-            comment_text += api_key.api_id + "\n\n"
-            for character in api_key.characters:
-                comment_text += "- " + character.character_name + "\n"
+        api_keys = db.session.query(EveApiKeyPair.api_id, EveCharacter.character_name).outerjoin(
+            EveCharacter, EveCharacter.api_id == EveApiKeyPair.api_id).filter(
+            EveApiKeyPair.user_id == user.id).order_by(EveApiKeyPair.api_id, EveCharacter.character_name)
+        for api_id, rows in groupby(api_keys, key=lambda row: row[0]):
+            comment_text += api_id + "\n\n"
+            for _, character_name in rows:
+                if character_name is not None:
+                    comment_text += "- " + character_name + "\n"
             comment_text += "\n"
-        RecruitManager.create_comment(application, comment_text, 0)
-
-        return application
-
-
-    @staticmethod
-    def alter_application(application, action, user):
-        retval = 'unknown application action'
-        if action == "approve":
-            application.approved_denied = "Approved"
-            application.reviewer_user_id = user.id
-            application.last_user_id = user.id
-            application.training = False
-            application.save()
-            retval = "Approved"
-
-        elif action == "reject":
-            application.approved_denied = "Rejected"
-            application.reviewer_user_id = user.id
-            application.last_user_id = user.id
-            application.training = False
-            application.save()
-            retval = "Rejected"
 
-        elif action == 'new':
-            application.approved_denied = 'New'
-            application.last_user_id = user.id
+        with unit_of_work():
             application.save()
-            retval = 'New'
+            ApplicationCounterManager.adjust(ApplicationCounterManager.key(application), 1)
 
-        elif action == "undecided":
-            application.approved_denied = "Undecided"
-            application.last_user_id = user.id
-            application.save()
-            retval = "Undecided"
-
-        elif action == "stasis":
-            application.approved_denied = "Role Stasis"
-            application.last_user_id = user.id
-            application.save()
-            retval = "Role Stasis"
-
-        elif action == "director_review":
-            application.approved_denied = "Needs Director Review"
-            application.last_user_id = user.id
-            application.save()
-            retval = "Needs Director Review"
+            comment = HrApplicationComment()
+            comment.application_id = application.id
+            comment.comment = comment_text
+            comment.save()
 
-        elif action == "waiting":
-            application.approved_denied = "Awaiting Response"
-            application.last_user_id = user.id
-            application.save()
-            retval = "Awaiting Response"
+            # Nothing outside the database hears about the application until it's committed
+            after_commit(lambda: RecruitManager.application_created(application, user.id))
 
-        elif action == "hide":
-            application.hidden = True
-            application.last_user_id = user.id
-            application.save()
-            retval = "hidden"
+        return application
 
-        elif action == "unhide":
-            application.hidden = False
-            application.last_user_id = user.id
-            application.save()
-            retval = "unhidden"
+    @staticmethod
+    def application_created(application, user_id):
+        DossierManager.invalidate_user(user_id)
+        RecruitManager.application_action_notify(application, 'new')
 
-        elif action == "delete":
-            application.delete()
-            retval = "deleted"
+        # The MinHash is pure Python and too slow to sit inside the submit
+        try:
+            sign_application.delay(application.id)
+        except RedisError as error:
+            current_app.logger.warning(error)
 
-        elif action == 'close':
-            application.approved_denied = 'Closed'
-            application.last_user_id = user.id
-            application.training = False
-            application.save()
-            retval = 'Closed'
+        # Get the applicant's keys refreshed ahead of the normal rotation and their
+        # GSF blacklist status resolved before a recruiter opens the application
+        try:
+            ApiKeyRefreshQueue.boost_user(user_id)
+        except RedisError as error:
+            current_app.logger.warning(error)
+        try:
+            prefetch_gsf_blacklist.delay(user_id)
+        except RedisError as error:
+            current_app.logger.warning(error)
 
-        elif action == 'needs_processing':
-            application.approved_denied = 'Needs Processing'
-            application.last_user_id = user.id
-            application.save()
-            retval = 'Needs Processing'
 
-        elif action == 'missing_ingame':
-            application.approved_denied = 'Missing In-Game'
-            application.last_user_id = user.id
-            application.save()
-            retval = 'Missing In-Game'
+    @staticmethod
+    def alter_application(application, action, user):
+        retval = 'unknown application action'
+        applicant_id = application.user_id
+        counter_key = ApplicationCounterManager.key(application)
+        with unit_of_work():
+            if action == "approve":
+                application.approved_denied = "Approved"
+                application.reviewer_user_id = user.id
+                application.last_user_id = user.id
+                application.training = False
+                application.save()
+                retval = "Approved"
+
+            elif action == "reject":
+                application.approved_denied = "Rejected"
+                application.reviewer_user_id = user.id
+                application.last_user_id = user.id
+                application.training = False
+                application.save()
+                retval = "Rejected"
+
+            elif action == 'new':
+                application.approved_denied = 'New'
+                application.last_user_id = user.id
+                application.save()
+                retval = 'New'
+
+            elif action == "undecided":
+                application.approved_denied = "Undecided"
+                application.last_user_id = user.id
+                application.save()
+                retval = "Undecided"
+
+            elif action == "stasis":
+                application.approved_denied = "Role Stasis"
+                application.last_user_id = user.id
+                application.save()
+                retval = "Role Stasis"
+
+            elif action == "director_review":
+                application.approved_denied = "Needs Director Review"
+                application.last_user_id = user.id
+                application.save()
+                retval = "Needs Director Review"
+
+            elif action == "waiting":
+                application.approved_denied = "Awaiting Response"
+                application.last_user_id = user.id
+                application.save()
+                retval = "Awaiting Response"
+
+            elif action == "hide":
+                application.hidden = True
+                application.last_user_id = user.id
+                application.save()
+                retval = "hidden"
+
+            elif action == "unhide":
+                application.hidden = False
+                application.last_user_id = user.id
+                application.save()
+                retval = "unhidden"
+
+            elif action == "delete":
+                application.delete()
+                retval = "deleted"
+
+            elif action == 'close':
+                application.approved_denied = 'Closed'
+                application.last_user_id = user.id
+                application.training = False
+                application.save()
+                retval = 'Closed'
+
+            elif action == 'needs_processing':
+                application.approved_denied = 'Needs Processing'
+                application.last_user_id = user.id
+                application.save()
+                retval = 'Needs Processing'
+
+            elif action == 'missing_ingame':
+                application.approved_denied = 'Missing In-Game'
+                application.last_user_id = user.id
+                application.save()
+                retval = 'Missing In-Game'
             
-        elif action == 'training':
-            application.training = not application.training;
-            application.save()
-            if application.training:
-                retval = 'is now a training application and will be shown first'
+            elif action == 'training':
+                application.training = not application.training;
+                application.save()
+                if application.training:
+                    retval = 'is now a training application and will be shown first'
+                else:
+                    retval = 'is no longer a training app'
+
+            # Counters and the involvement index move in the same transaction as the application
+            if action == 'delete':
+                ApplicationCounterManager.adjust(counter_key, -1)
             else:
-                retval = 'is no longer a training app'
+                ApplicationCounterManager.move(counter_key, ApplicationCounterManager.key(application))
+                InvolvementManager.touch(user.id, application.id)
 
+        # Related applications on the applicant's other dossiers show the new state
+        DossierManager.invalidate_user(applicant_id)
         RecruitManager.application_action_notify(application, action)
         return retval
 
@@ -204,27 +300,14 @@ class RecruitManager:
             message_text = "Application from {0} needs processing: {1}".format(application.main_character_name, url_for('recruit.application_view', _external=True, application_id=application.id))
         elif action == 'director_review':
             message_text = "Application from {0} needs director review: {1}".format(application.main_character_name, url_for('recruit.application_view', _external=True, application_id=application.id))
+        else:
+            return
 
-        # Send the message
-        try:
-            RecruitManager.send_slack_notification(message_text)
-        except:
-            pass
+        SlackManager.notify(application.id, message_text)
 
     @staticmethod
     def comment_notify(comment):
         # Find all instances of @xxxx text and send slack notifications to those users.  If the user doesn't exist slack will just ignore.
-        for ping in re.findall('(?:^|\s)(@\w+)', comment.comment):
-            message = "You were mentioned in an application comment: {0}".format(url_for('recruit.application_view', _external=True, application_id=comment.application_id, _anchor="comment{0}".format(comment.id)))
-            RecruitManager.send_slack_notification(message, ping)
-
-    @staticmethod
-    def send_slack_notification(message, channel=None):
-        try:
-            data = { 'text': message }
-            if channel is not None:
-                data['channel'] = channel
-            headers = {'Content-Type': 'application/json'}
-            requests.post(current_app.config['SLACK_WEBHOOK'], json=data, headers=headers)
-        except:
-            pass
+        message = "You were mentioned in an application comment: {0}".format(url_for('recruit.application_view', _external=True, application_id=comment.application_id, _anchor="comment{0}".format(comment.id)))
+        for ping in set(re.findall('(?:^|\s)(@\w+)', comment.comment)):
+            SlackManager.notify(comment.application_id, message, ping)
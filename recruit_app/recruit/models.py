@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 
 from recruit_app.extensions import bcrypt
-from recruit_app.database import Column, db, Model, ReferenceCol, relationship, SurrogatePK, TimeMixin
+from recruit_app.database import Column, db, Model, ReferenceCol, relationship, SurrogatePK, TimeMixin, trigram_index
 from sqlalchemy.orm import backref
+from sqlalchemy.dialects import postgresql
 
 # import flask_whooshalchemy as whooshalchemy
 # from sqlalchemy_searchable import make_searchable
@@ -10,16 +11,19 @@ from sqlalchemy.orm import backref
 #
 # from sqlalchemy_searchable import SearchQueryMixin
 from flask_sqlalchemy import BaseQuery
-# from sqlalchemy.dialects import postgresql
 
 import datetime
 
 # make_searchable()
 
 
+# Decided applications, everything else is still being worked by recruiters
+CLOSED_APPLICATION_STATES = ['Closed', 'Rejected', 'Approved']
+
+
 character_apps = db.Table('app_characters',
         db.Column('app_id', db.Integer(), db.ForeignKey('hr_applications.id')),
-        db.Column('character_id', db.String(), db.ForeignKey('characters.character_id')))
+        db.Column('character_id', db.String(), db.ForeignKey('characters.character_id'), index=True))
 
 
 class HrApplication(SurrogatePK, TimeMixin, Model):
@@ -83,6 +87,38 @@ class HrApplication(SurrogatePK, TimeMixin, Model):
     def __str__(self):
         return '<Application %r>' % str(self.main_character_name)
 
+trigram_index('ix_hr_applications_main_character_name_trgm', HrApplication.__table__.c.main_character_name)
+
+
+class HrApplicationCounter(Model):
+    """Number of applications per status, hidden and training flag, kept by ApplicationCounterManager."""
+    __tablename__ = 'hr_application_counters'
+
+    approved_denied = Column(db.Text, primary_key=True)
+    hidden = Column(db.Boolean, primary_key=True)
+    training = Column(db.Boolean, primary_key=True)
+    count = Column(db.Integer, nullable=False, default=0)
+
+
+class HrApplicationInvolvement(Model):
+    """Applications a user has commented on, reviewed or acted on, kept by InvolvementManager."""
+    __tablename__ = 'hr_application_involvements'
+
+    user_id = Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    application_id = Column(db.Integer, db.ForeignKey('hr_applications.id', ondelete='CASCADE'), primary_key=True)
+    last_touch = Column(db.DateTime(), nullable=False, default=datetime.datetime.utcnow)
+
+
+class HrApplicationSignature(Model):
+    """MinHash signature of an application's answers and its LSH band buckets, kept by SimilarityManager."""
+    __tablename__ = 'hr_application_signatures'
+
+    application_id = Column(db.Integer, db.ForeignKey('hr_applications.id', ondelete='CASCADE'), primary_key=True)
+    signature = Column(db.LargeBinary, nullable=False)
+    buckets = Column(postgresql.ARRAY(db.BigInteger), nullable=False)
+
+db.Index('ix_hr_application_signatures_buckets', HrApplicationSignature.__table__.c.buckets, postgresql_using='gin')
+
 
 class HrApplicationComment(SurrogatePK, TimeMixin, Model):
     __tablename__ = 'hr_comments'
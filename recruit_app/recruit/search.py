@@ -1,7 +1,7 @@
-import flask_whooshalchemy as whooshalchemy
+from redone_search import whoosh_index
 
 from models import HrApplication, HrApplicationComment
 
 def register_search_models(app):
-    pass
-    # whooshalchemy.whoosh_index(app, HrApplication)
+    # Indexing runs on the rq workers, so this no longer slows down commits
+    whoosh_index(app, HrApplication)
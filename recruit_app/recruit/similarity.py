@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+from recruit_app.recruit.models import HrApplication, HrApplicationSignature
+from recruit_app.extensions import db
+
+import hashlib
+import random
+import re
+import struct
+import zlib
+
+# Everything the applicant writes, copy pasted answers show up here
+TEXT_FIELDS = ['thesis', 'how_long', 'notable_accomplishments', 'corporation_history', 'why_leaving', 'what_know',
+               'what_expect', 'bought_characters', 'why_interested', 'find_out', 'favorite_role']
+
+SHINGLE_SIZE = 3
+PRIME = (1 << 61) - 1
+# 16 bands of 4 rows put the LSH threshold near a Jaccard similarity of (1/16)^(1/4) = 0.5
+BANDS = 16
+ROWS = 4
+THRESHOLD = 0.5
+
+_random = random.Random(6151)
+PERMUTATIONS = [(_random.randint(1, PRIME - 1), _random.randint(0, PRIME - 1)) for _ in range(BANDS * ROWS)]
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def shingles(text):
+    """CRC32 hashes of the overlapping word triples in text."""
+    words = WORD.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        words = [u' '.join(words)] if words else []
+    else:
+        words = [u' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+    return set(zlib.crc32(word.encode('utf-8')) & 0xffffffff for word in words)
+
+
+def signature(text):
+    """MinHash signature of text, one 64 bit minimum per permutation, or None without any words."""
+    hashes = shingles(text)
+    if not hashes:
+        return None
+    return [min((a * x + b) % PRIME for x in hashes) for a, b in PERMUTATIONS]
+
+
+def buckets(sig):
+    """One bucket per band, the band number is hashed in so bands never collide with each other."""
+    result = []
+    for band in range(BANDS):
+        rows = struct.pack('<H{0}Q'.format(ROWS), band, *sig[band * ROWS:(band + 1) * ROWS])
+        result.append(struct.unpack('<q', hashlib.md5(rows).digest()[:8])[0])
+    return result
+
+
+def similarity(first, second):
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    return sum(1 for a, b in zip(first, second) if a == b) / float(len(first))
+
+
+class SimilarityManager:
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def text(application):
+        return u'\n'.join(getattr(application, field) or u'' for field in TEXT_FIELDS)
+
+    @staticmethod
+    def record(application):
+        """Store the application's signature and buckets in the current transaction.
+
+        Returns False for applications without any text, they get no signature.
+        """
+        sig = signature(SimilarityManager.text(application))
+        if sig is None:
+            return False
+        db.session.merge(HrApplicationSignature(application_id=application.id,
+                                                signature=SimilarityManager.pack(sig),
+                                                buckets=buckets(sig)))
+        return True
+
+    @staticmethod
+    def similar_applications(application):
+        """(application, similarity) for earlier or later applications with near duplicate answers, best first."""
+        own = HrApplicationSignature.query.get(application.id)
+        if own is None:
+            return []
+        sig = SimilarityManager.unpack(own.signature)
+
+        # Only applications sharing a band bucket are compared, the GIN index finds them
+        candidates = db.session.query(HrApplicationSignature.signature, HrApplication).join(
+            HrApplication, HrApplication.id == HrApplicationSignature.application_id).filter(
+            HrApplicationSignature.buckets.overlap(own.buckets),
+            HrApplicationSignature.application_id != application.id,
+            HrApplication.user_id != application.user_id)
+
+        matches = []
+        for packed, candidate in candidates:
+            score = similarity(sig, SimilarityManager.unpack(packed))
+            if score >= THRESHOLD:
+                matches.append((candidate, score))
+        matches.sort(key=lambda match: -match[1])
+        return matches
+
+    @staticmethod
+    def pack(sig):
+        return struct.pack('<{0}Q'.format(len(sig)), *sig)
+
+    @staticmethod
+    def unpack(packed):
+        packed = bytes(packed)
+        return struct.unpack('<{0}Q'.format(len(packed) // 8), packed)
+
+    @staticmethod
+    def rebuild(batch=500):
+        """Sign every application that has no signature yet, e.g. ones from before signatures existed."""
+        count = 0
+        last_id = 0
+        while True:
+            # Seek on id, applications without any text never get a signature
+            applications = HrApplication.query.outerjoin(
+                HrApplicationSignature, HrApplicationSignature.application_id == HrApplication.id).filter(
+                HrApplicationSignature.application_id == None, HrApplication.id > last_id).order_by(
+                HrApplication.id).limit(batch).all()
+            if not applications:
+                return count
+            for application in applications:
+                if SimilarityManager.record(application):
+                    count += 1
+            db.session.commit()
+            last_id = applications[-1].id
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from flask import current_app
+from flask_rq import job, get_connection
+from redis import RedisError
+from requests.adapters import HTTPAdapter
+from rq_scheduler import Scheduler
+
+import datetime as dt
+import json
+import os
+import requests
+
+_http_session = None
+_http_session_pid = None
+
+
+class SlackManager:
+    """Slack messages are queued per application and sent by a job on the high queue.
+
+    Everything queued for an application within SLACK_COALESCE_WINDOW seconds of the
+    first message goes out as one message per channel.
+    """
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def pending_key(application_id):
+        return 'slack:pending:{0}'.format(application_id)
+
+    @staticmethod
+    def scheduled_key(application_id):
+        return 'slack:scheduled:{0}'.format(application_id)
+
+    @staticmethod
+    def notify(application_id, message, channel=None):
+        if not current_app.config.get('SLACK_WEBHOOK'):
+            return
+
+        window = current_app.config['SLACK_COALESCE_WINDOW']
+        try:
+            connection = get_connection()
+            connection.rpush(SlackManager.pending_key(application_id), json.dumps({'channel': channel, 'text': message}))
+            # Only the first message in a window schedules the send, the rest ride along
+            if connection.set(SlackManager.scheduled_key(application_id), 1, nx=True, ex=window):
+                Scheduler(queue_name='high', connection=connection).enqueue_in(
+                    dt.timedelta(seconds=window), send_slack_notifications, application_id)
+        except RedisError as error:
+            current_app.logger.warning(error)
+
+    @staticmethod
+    def take(application_id):
+        """Remove the application's queued messages and return {channel: text}, one line per distinct message."""
+        connection = get_connection()
+        pipe = connection.pipeline()
+        pipe.lrange(SlackManager.pending_key(application_id), 0, -1)
+        pipe.delete(SlackManager.pending_key(application_id))
+        # Cleared with the drain, so the next message schedules a new send instead of waiting on this one
+        pipe.delete(SlackManager.scheduled_key(application_id))
+        entries, _, _ = pipe.execute()
+
+        messages = {}
+        for entry in entries:
+            entry = json.loads(entry)
+            lines = messages.setdefault(entry['channel'], [])
+            if entry['text'] not in lines:
+                lines.append(entry['text'])
+        return dict((channel, u'\n'.join(lines)) for channel, lines in messages.iteritems())
+
+    @staticmethod
+    def http_session():
+        global _http_session, _http_session_pid
+        if _http_session is None or _http_session_pid != os.getpid():
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=current_app.config['SLACK_POOL_SIZE'])
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({'Content-Type': 'application/json'})
+
+            _http_session = session
+            _http_session_pid = os.getpid()
+
+        return _http_session
+
+    @staticmethod
+    def send(message, channel=None):
+        data = {'text': message}
+        if channel is not None:
+            data['channel'] = channel
+        response = SlackManager.http_session().post(current_app.config['SLACK_WEBHOOK'], json=data,
+                                                    timeout=current_app.config['SLACK_TIMEOUT'])
+        response.raise_for_status()
+
+
+@job('high')
+def send_slack_notifications(application_id):
+    with current_app.app_context():
+        for channel, message in SlackManager.take(application_id).iteritems():
+            try:
+                SlackManager.send(message, channel)
+            except requests.RequestException as error:
+                # Slack being down shouldn't hold back the other channels
+                current_app.logger.warning(error)
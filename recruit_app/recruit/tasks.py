@@ -0,0 +1,39 @@
+from recruit_app.recruit.counters import ApplicationCounterManager
+from recruit_app.recruit.involvement import InvolvementManager
+from recruit_app.recruit.similarity import SimilarityManager
+from recruit_app.recruit.models import HrApplication
+from recruit_app.fulltext import FullTextManager
+from recruit_app.extensions import db
+
+from flask_rq import job
+from flask import current_app
+
+
+@job('low')
+def run_application_counter_reconcile():
+    # Catches anything that changed applications outside RecruitManager, e.g. the admin
+    with current_app.app_context():
+        ApplicationCounterManager.reconcile()
+
+
+@job('low')
+def run_involvement_rebuild():
+    with current_app.app_context():
+        InvolvementManager.rebuild()
+
+
+@job('low')
+def run_full_text_rebuild():
+    # The delta each process keeps on top of the index only grows until this runs
+    with current_app.app_context():
+        if FullTextManager.available():
+            FullTextManager.rebuild()
+
+
+@job('medium')
+def sign_application(application_id):
+    # Queued once the application is committed, manage.py sign_applications catches any that were missed
+    with current_app.app_context():
+        application = HrApplication.query.get(application_id)
+        if application is not None and SimilarityManager.record(application):
+            db.session.commit()
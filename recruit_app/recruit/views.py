@@ -2,13 +2,21 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_security.decorators import login_required
 from flask_security import current_user, roles_accepted
 
-from recruit_app.user.models import EveCharacter
+from recruit_app.user.models import EveCharacter, User
 from recruit_app.recruit.models import HrApplication, HrApplicationComment
 from recruit_app.recruit.managers import RecruitManager
 from recruit_app.recruit.forms import HrApplicationForm, HrApplicationCommentForm, HrApplicationCommentEdit, SearchForm
-from recruit_app.blacklist.models import BlacklistCharacter, BlacklistGSF
+from recruit_app.recruit.dossier import DossierManager
+from recruit_app.recruit.counters import ApplicationCounterManager
+from recruit_app.recruit.involvement import InvolvementManager
+from recruit_app.recruit.similarity import SimilarityManager
+from recruit_app.fulltext import FullTextManager, APPLICATION
+from recruit_app.database import KeysetPagination
 
-from sqlalchemy import desc, asc
+from flask_rq import get_connection
+from redis import RedisError
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 
 
 blueprint = Blueprint("recruit", __name__, url_prefix='/recruits',
@@ -19,8 +27,10 @@ blueprint = Blueprint("recruit", __name__, url_prefix='/recruits',
 @blueprint.route("/my_applications/<int:page>", methods=['GET'])
 @login_required
 def applications(page=1):
-    query = HrApplication.query.filter(HrApplication.hidden == False, HrApplication.user_id == current_user.get_id()).order_by(desc(HrApplication.id))
-    personal_applications = query.paginate(page, current_app.config['MAX_NUMBER_PER_PAGE'], False)
+    query = HrApplication.query.filter(HrApplication.hidden == False, HrApplication.user_id == current_user.get_id())
+    personal_applications = KeysetPagination(query, [(HrApplication.id, True)], lambda app: (app.id,),
+                                             current_app.config['MAX_NUMBER_PER_PAGE'],
+                                             after=request.args.get('after'), before=request.args.get('before'))
 
     return render_template('recruit/applications.html', personal_applications=personal_applications)
 
@@ -33,13 +43,18 @@ def application_queue(page=1, filter=0):
 
     search_form = SearchForm()
 
-    if request.method == 'POST' and search_form.validate_on_submit() and search_form.search.data:
-        query = HrApplication.query.outerjoin(EveCharacter, EveCharacter.user_id == HrApplication.user_id).filter(
-            EveCharacter.character_name.ilike("%" + str(search_form.search.data) + "%")|
-            HrApplication.main_character_name.ilike(unicode("%" + search_form.search.data + "%")))
+    searching = request.method == 'POST' and search_form.validate_on_submit() and search_form.search.data
+    if searching and search_form.full_text.data:
+        if FullTextManager.available():
+            query = FullTextManager.search_query(HrApplication, APPLICATION, search_form.search.data)
+        else:
+            # Whoosh index kept up to date by the rq workers, ranked in SQL
+            query = HrApplication.query.whoosh_search(search_form.search.data, or_=True)
 
-        query2 = HrApplication.query.filter(HrApplication.characters.any(EveCharacter.character_name.ilike("%" + str(search_form.search.data) + "%")))
-        query = query.union(query2)
+        page = 1 # Reset the page to 1 on search
+    elif searching:
+        # Already ranked by how closely the names match
+        query = RecruitManager.search_applications(search_form.search.data)
 
         page = 1 # Reset the page to 1 on search
 
@@ -52,22 +67,53 @@ def application_queue(page=1, filter=0):
             HrApplication.approved_denied != "Rejected",
             HrApplication.approved_denied != "Approved")
     else: # filter == 2, Current user's applications         
-        query = HrApplication.query.filter(HrApplication.hidden == False)
-        query2 = query.filter(
-            (HrApplication.reviewer_user_id == current_user.get_id()) |
-            (HrApplication.last_user_id == current_user.get_id()))
-        query = query.join(HrApplicationComment, (HrApplication.id == HrApplicationComment.application_id) & (HrApplicationComment.user_id == current_user.get_id()))
-        query = query.union(query2)
-
-    if current_user.has_role('training'):
-        query = query.order_by(HrApplication.training.desc(), HrApplication.id)
-    else:
-        query = query.order_by(HrApplication.id)
-    
-    # Add sort and pagination options to the query
-    recruiter_queue = query.paginate(page, current_app.config['MAX_NUMBER_PER_PAGE'], False)
+        query = InvolvementManager.applications_query(current_user.get_id()).filter(HrApplication.hidden == False)
 
-    return render_template('recruit/application_queue.html', recruiter_queue=recruiter_queue, search_form=search_form)
+    if searching:
+        recruiter_queue = query.paginate(page, current_app.config['MAX_NUMBER_PER_PAGE'], False)
+    else:
+        # Seek on the sort key so deep pages cost the same as the first one
+        if current_user.has_role('training'):
+            keys = [(func.coalesce(HrApplication.training, False), True), (HrApplication.id, False)]
+            values = lambda app: (bool(app.training), app.id)
+        else:
+            keys = [(HrApplication.id, False)]
+            values = lambda app: (app.id,)
+
+        if filter == 1:
+            total = ApplicationCounterManager.visible_count()
+        elif filter == 0:
+            total = ApplicationCounterManager.open_count()
+        else:
+            total = cached_total('application_queue_total:2:{0}'.format(current_user.get_id()), query)
+
+        recruiter_queue = KeysetPagination(query, keys, values, current_app.config['MAX_NUMBER_PER_PAGE'],
+                                           after=request.args.get('after'), before=request.args.get('before'),
+                                           total=total)
+
+    return render_template('recruit/application_queue.html', recruiter_queue=recruiter_queue, search_form=search_form, filter=filter,
+                           status_counts=ApplicationCounterManager.status_counts(),
+                           training_count=ApplicationCounterManager.training_count())
+
+
+def cached_total(key, query):
+    # Counting the whole queue on every page is what paginate() made expensive. Kept
+    # in Redis like the counters and dossiers, CACHE_TYPE defaults to null
+    try:
+        connection = get_connection()
+        total = connection.get(key)
+        if total is not None:
+            return int(total)
+    except RedisError as error:
+        current_app.logger.warning(error)
+        return query.order_by(None).count()
+
+    total = query.order_by(None).count()
+    try:
+        connection.set(key, total, ex=current_app.config['QUEUE_TOTAL_CACHE_TIMEOUT'])
+    except RedisError as error:
+        current_app.logger.warning(error)
+    return total
 
 
 @blueprint.route("/applications/create", methods=['GET', 'POST'])
@@ -96,83 +142,57 @@ def application_create():
 @blueprint.route("/applications/<int:application_id>/", methods=['GET', 'POST'])
 @login_required
 def application_view(application_id):
-    comments = []
-    characters = []
-    related = []
-
     form_app = HrApplicationForm()
     form_comment = HrApplicationCommentForm()
     form_edit = HrApplicationCommentEdit()
 
-    query = HrApplication.query.filter_by(id=application_id)
+    query = HrApplication.query.filter_by(id=application_id).options(
+        joinedload(HrApplication.user),
+        joinedload(HrApplication.reviewer_user).joinedload(User.main_character),
+        joinedload(HrApplication.last_action_user).joinedload(User.main_character))
     application = query.first()
     if application:
         if current_user.has_role("recruiter") or current_user.has_role("admin") or current_user.has_role('reviewer'):
-            characters = EveCharacter.query.filter_by(user_id=application.user_id).order_by(EveCharacter.api_id).all()
-            characters += EveCharacter.query.filter(EveCharacter.previous_users.any(id=application.user_id)).all()
-
-            evewho = {}
-            for character in characters:
-                evewho[character.character_name] = character.character_name.replace(' ','+')
-
-            # Get related applications
-            related = HrApplication.query.filter(HrApplication.user_id == application.user_id, HrApplication.id != application.id).order_by(HrApplication.id).all()
-
-            comments = HrApplicationComment.query.filter_by(
-                application_id=application_id)\
-                .order_by(asc(HrApplicationComment.created_time))\
-                .all()
+            dossier = DossierManager.get_dossier(application)
 
             blacklist_clean = True
 
             # Check for IPs on the blacklist
-            blacklist_ips = list(set([x.ip_address for x in BlacklistCharacter.query.all() if x.ip_address is not None and x.ip_address is not u'']))
-            ips = [i for e in blacklist_ips for i in application.user.get_ips() if e in i]
-            if len(ips) > 0:
-                flash("Heads up this person's IP is on the blacklist:" + unicode(ips), 'error')
+            if dossier['blacklisted_ips']:
+                flash("Heads up this person's IP is on the blacklist:" + unicode(dossier['blacklisted_ips']), 'error')
                 blacklist_clean = False
 
             # Check for character names on the GSF RC Blacklist
-            gsf_blacklist = {}
-            for character in characters:
-                gsf_blacklist[character.character_name] = "UNKNOWN"
-
-            gsf_blacklist_str = ''
-            for character in characters:
-                result = BlacklistGSF.getStatus(character)
-                gsf_blacklist[character.character_name] = result
-                if result != 'NOT FOUND' and result != 'CLEARED':
-                    gsf_blacklist_str += ' ' + character.character_name
-
-            if len(gsf_blacklist_str) > 0:
-                flash("Check GSF blacklist results for character(s)" + unicode(gsf_blacklist_str), 'error')
+            if dossier['gsf_flagged']:
+                flash("Check GSF blacklist results for character(s) " + u' '.join(dossier['gsf_flagged']), 'error')
                 blacklist_clean = False
 
             # Check for character names on the internal blacklist
-            blacklist_string = ''
-            for character in characters:
-                blacklist_string = blacklist_string + ' ' + str(character.character_name)
-
-            # blacklist_query = BlacklistCharacter.query.whoosh_search(blacklist_string, or_=True).all()
-            query = BlacklistCharacter.query.filter(BlacklistCharacter.name.in_([x.character_name for x in characters])).all()
-
-            if query:
-                flash('Double check blacklist, ' + str(query) + ' matched', 'error')
+            if dossier['blacklist_matches']:
+                flash('Double check blacklist, ' + dossier['blacklist_matches'] + ' matched', 'error')
                 blacklist_clean = False
 
             if blacklist_clean:
                 flash('All blacklists are clean.')
 
+            # Not part of the dossier, another applicant's new application can match this one
+            similar = SimilarityManager.similar_applications(application)
+            if similar:
+                flash('Answers are near duplicates of ' + u', '.join(
+                    u'{0} ({1:.0%})'.format(other.main_character_name, score) for other, score in similar), 'error')
+
             return render_template('recruit/application.html',
                                    application=application,
-                                   characters=characters,
-                                   related=related,
-                                   comments=comments,
+                                   characters=dossier['characters'],
+                                   related=dossier['related'],
+                                   similar=similar,
+                                   comments=dossier['comments'],
+                                   api_keys=dossier['api_keys'],
                                    form_comment=form_comment,
                                    form_edit=form_edit,
                                    form_app=form_app,
-                                   gsf_blacklist=gsf_blacklist,
-                                   evewho=evewho)
+                                   gsf_blacklist=dossier['gsf_blacklist'],
+                                   evewho=dossier['evewho'])
 
         elif int(application.user_id) == int(current_user.get_id()):
 
@@ -212,16 +232,19 @@ def application_comment_action(application_id, comment_id, action):
                 comment = HrApplicationComment.query.filter_by(id=comment_id).first()
 
                 if comment.user_id == int(current_user.get_id()) or current_user.has_role("admin"):
+                    applicant_id = comment.application.user_id
                     if request.method == 'POST':
                         if action == "edit":
                             if form_edit.validate_on_submit():
-                                RecruitManager.edit_comment(comment, form_edit.comment.data, current_user.get_id())
+                                RecruitManager.edit_comment(comment, form_edit.comment.data, current_user)
 
                         elif action == "delete":
                             comment.delete()
 
                     elif action == "delete":
                         comment.delete()
+
+                    DossierManager.invalidate_user(applicant_id)
             return redirect(url_for('recruit.application_view', application_id=application_id))
 
     return redirect(url_for('recruit.applications'))
@@ -3,7 +3,9 @@ from redis import Redis
 
 from rq_scheduler import Scheduler
 
-from recruit_app.user.tasks import run_alliance_corp_update, run_api_key_update
+from recruit_app.user.tasks import run_alliance_corp_update, run_api_key_refresh_seed, run_api_key_refresh_tick
+from recruit_app.blacklist.tasks import run_gsf_blacklist_update
+from recruit_app.recruit.tasks import run_application_counter_reconcile, run_involvement_rebuild, run_full_text_rebuild
 
 import datetime as dt
 
@@ -17,10 +19,42 @@ def schedule_tasks():
         interval=21600,
         queue_name='low',
         )
+    # Keys are refreshed continuously from the staleness queue, the seed picks up
+    # new keys and open applications
     scheduler.schedule(
         scheduled_time=dt.datetime.now(),
-        func=run_api_key_update,
-        interval=10800,
+        func=run_api_key_refresh_seed,
+        interval=3600,
+        queue_name='low',
+        )
+    scheduler.schedule(
+        scheduled_time=dt.datetime.now(),
+        func=run_api_key_refresh_tick,
+        interval=60,
+        queue_name='low',
+        )
+    scheduler.schedule(
+        scheduled_time=dt.datetime.now(),
+        func=run_gsf_blacklist_update,
+        interval=3600,
+        queue_name='low',
+        )
+    scheduler.schedule(
+        scheduled_time=dt.datetime.now(),
+        func=run_application_counter_reconcile,
+        interval=3600,
+        queue_name='low',
+        )
+    scheduler.schedule(
+        scheduled_time=dt.datetime.now(),
+        func=run_involvement_rebuild,
+        interval=86400,
+        queue_name='low',
+        )
+    scheduler.schedule(
+        scheduled_time=dt.datetime.now(),
+        func=run_full_text_rebuild,
+        interval=86400,
         queue_name='low',
         )
     return None
\ No newline at end of file
@@ -53,11 +53,33 @@ class Config(object):
     GSF_USERNAME = os.getenv('GSF_USERNAME', '')
     GSF_PASSWORD = os.getenv('GSF_PASSWORD', '')
     GSF_BLACKLIST_URL = os.getenv('GSF_BLACKLIST_URL')
+    GSF_BLACKLIST_TIMEOUT = float(os.getenv('GSF_BLACKLIST_TIMEOUT', 5))
+    GSF_BLACKLIST_WORKERS = int(os.getenv('GSF_BLACKLIST_WORKERS', 8))
+    DOSSIER_TTL = int(os.getenv('DOSSIER_TTL', 900))
+    QUEUE_TOTAL_CACHE_TIMEOUT = int(os.getenv('QUEUE_TOTAL_CACHE_TIMEOUT', 300))
+    BM25_INDEX_PATH = os.getenv('BM25_INDEX_PATH')  # Full text search is off unless set, needs numpy
+    BM25_REFRESH_INTERVAL = int(os.getenv('BM25_REFRESH_INTERVAL', 60))
 
     API_MASK = 4294967295
+    API_KEY_UPDATE_SHARD_SIZE = int(os.getenv('API_KEY_UPDATE_SHARD_SIZE', 200))
+    CORPORATION_UPDATE_SHARD_SIZE = int(os.getenv('CORPORATION_UPDATE_SHARD_SIZE', 200))
+    API_KEY_REFRESH_INTERVAL = int(os.getenv('API_KEY_REFRESH_INTERVAL', 10800))
+    API_KEY_REFRESH_BOOSTED_INTERVAL = int(os.getenv('API_KEY_REFRESH_BOOSTED_INTERVAL', 1800))
+    API_KEY_REFRESH_BATCH = int(os.getenv('API_KEY_REFRESH_BATCH', 50))
     SLACK_WEBHOOK = os.getenv('SLACK_WEBHOOK')
+    SLACK_TIMEOUT = float(os.getenv('SLACK_TIMEOUT', 5))
+    SLACK_POOL_SIZE = int(os.getenv('SLACK_POOL_SIZE', 4))
+    SLACK_COALESCE_WINDOW = int(os.getenv('SLACK_COALESCE_WINDOW', 30))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     EVEAPI_URL = os.getenv('EVEAPI_URL', 'api.eveonline.com')
+    EVEAPI_POOL_SIZE = int(os.getenv('EVEAPI_POOL_SIZE', 10))
+    EVEAPI_CONNECT_TIMEOUT = float(os.getenv('EVEAPI_CONNECT_TIMEOUT', 5))
+    EVEAPI_READ_TIMEOUT = float(os.getenv('EVEAPI_READ_TIMEOUT', 30))
+    EVEAPI_RETRIES = int(os.getenv('EVEAPI_RETRIES', 3))
+    EVEAPI_RETRY_BACKOFF = float(os.getenv('EVEAPI_RETRY_BACKOFF', 0.5))
+    EVEAPI_CACHE_ENABLED = os.getenv('EVEAPI_CACHE_ENABLED', 'true').lower() == 'true'
+    EVEAPI_CACHE_REDIS_URL = os.getenv('EVEAPI_CACHE_REDIS_URL', os.getenv('REDISTOGO_URL', 'redis://localhost:6379/0'))
+    AFFILIATION_CACHE_TTL = int(os.getenv('AFFILIATION_CACHE_TTL', 3600))
     
     TAIGA_USER = os.getenv('TAIGA_USER')
     TAIGA_PASSWORD = os.getenv('TAIGA_PASSWORD')
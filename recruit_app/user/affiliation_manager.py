@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+from recruit_app.user.eve_api_manager import EveApiManager
+
+from flask import current_app
+from redis import RedisError
+
+import json
+
+# CharacterAffiliation takes a comma separated list, CCP caps it at 250 ids
+BATCH_SIZE = 250
+
+
+class AffiliationManager:
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def connection():
+        return EveApiManager.cache_connection()
+
+    @staticmethod
+    def cache_key(character_id):
+        return 'affiliation:{0}'.format(int(character_id))
+
+    @staticmethod
+    def get_affiliations(character_ids):
+        """Return {character_id: {'corp_id': .., 'alliance_id': ..}} for the given characters.
+
+        Answers come from Redis where possible, the rest are fetched from
+        CharacterAffiliation in batches and cached for AFFILIATION_CACHE_TTL seconds.
+        Characters the API could not resolve are left out.
+        """
+        character_ids = list(set(int(character_id) for character_id in character_ids))
+        affiliations = {}
+        if not character_ids:
+            return affiliations
+
+        conn = AffiliationManager.connection()
+        try:
+            cached = conn.mget([AffiliationManager.cache_key(character_id) for character_id in character_ids])
+        except RedisError as error:
+            current_app.logger.warning(error)
+            cached = [None] * len(character_ids)
+
+        missing = []
+        for character_id, value in zip(character_ids, cached):
+            if value is None:
+                missing.append(character_id)
+            else:
+                affiliations[character_id] = json.loads(value)
+
+        fetched = {}
+        for start in range(0, len(missing), BATCH_SIZE):
+            for character_id, result in EveApiManager.get_affiliations(missing[start:start + BATCH_SIZE]).items():
+                fetched[character_id] = {
+                    'corp_id': result['corp']['id'],
+                    'alliance_id': result['alliance']['id'] if 'alliance' in result else None,
+                }
+
+        if fetched:
+            try:
+                pipe = conn.pipeline()
+                for character_id, affiliation in fetched.items():
+                    pipe.set(AffiliationManager.cache_key(character_id), json.dumps(affiliation),
+                             ex=current_app.config['AFFILIATION_CACHE_TTL'])
+                pipe.execute()
+            except RedisError as error:
+                current_app.logger.warning(error)
+            affiliations.update(fetched)
+
+        return affiliations
+
+    @staticmethod
+    def get_affiliation(character_id):
+        return AffiliationManager.get_affiliations([character_id]).get(int(character_id))
+
+    @staticmethod
+    def check_if_character_is_in_corp(character_id, corp_id):
+        affiliation = AffiliationManager.get_affiliation(character_id)
+        if affiliation:
+            return affiliation['corp_id'] == corp_id
+
+        return False
+
+    @staticmethod
+    def check_if_character_is_in_alliance(character_id, alliance_id):
+        affiliation = AffiliationManager.get_affiliation(character_id)
+        if affiliation:
+            return affiliation['alliance_id'] == alliance_id
+
+        return False
@@ -1,28 +1,145 @@
 import evelink.api
 import evelink.char
 import evelink.eve
-from flask import current_app
-from recruit_app.extensions import cache_extension
+from flask import current_app, g
+
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from redis import Redis, RedisError
+
+# One keep-alive session per process, shared by every evelink.api.API we build.
+# Remember the pid so a forked gunicorn or rq work horse builds its own pool.
+_http_session = None
+_http_session_pid = None
+_cache_connection = None
+_response_cache = None
+
+
+class RedisAPICache(evelink.api.APICache):
+    """evelink response cache kept in Redis so web, rq and scheduler processes share it.
+
+    evelink keys entries on a hash of the endpoint and its parameters and hands
+    us cachedUntil - currentTime as the duration, so entries expire exactly when
+    CCP would serve fresh data.  Redis trouble only ever costs a cache miss.
+    """
+
+    def __init__(self, connection, prefix='evelink:'):
+        self.connection = connection
+        self.prefix = prefix
+
+    def get(self, key):
+        try:
+            return self.connection.get(self.prefix + key)
+        except RedisError as error:
+            current_app.logger.warning(error)
+            return None
+
+    def put(self, key, value, duration):
+        if duration < 1:
+            return
+        try:
+            self.connection.set(self.prefix + key, value, ex=int(duration))
+        except RedisError as error:
+            current_app.logger.warning(error)
+
 
 class EveApiManager():
 
     def __init__(self):
         pass
 
+    @staticmethod
+    def http_session():
+        global _http_session, _http_session_pid
+        if _http_session is None or _http_session_pid != os.getpid():
+            config = current_app.config
+            retry_kwargs = {
+                'total': config['EVEAPI_RETRIES'],
+                'backoff_factor': config['EVEAPI_RETRY_BACKOFF'],
+                'status_forcelist': (500, 502, 503, 504),
+            }
+            # Every EVE API call is a read-only POST, which urllib3 won't retry by default
+            if hasattr(Retry, 'DEFAULT_ALLOWED_METHODS'):
+                retry_kwargs['allowed_methods'] = False
+            else:
+                retry_kwargs['method_whitelist'] = False
+
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=config['EVEAPI_POOL_SIZE'],
+                                  max_retries=Retry(**retry_kwargs))
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({'User-Agent': evelink.api._user_agent})
+
+            # evelink passes this straight through to requests as the timeout
+            evelink.api.http_request_timeout = (config['EVEAPI_CONNECT_TIMEOUT'], config['EVEAPI_READ_TIMEOUT'])
+
+            _http_session = session
+            _http_session_pid = os.getpid()
+
+        return _http_session
+
+    @staticmethod
+    def cache_connection():
+        global _cache_connection
+        if _cache_connection is None:
+            _cache_connection = Redis.from_url(current_app.config['EVEAPI_CACHE_REDIS_URL'])
+
+        return _cache_connection
+
+    @staticmethod
+    def response_cache():
+        global _response_cache
+        if _response_cache is None:
+            _response_cache = RedisAPICache(EveApiManager.cache_connection())
+
+        return _response_cache
+
     @staticmethod
     def evelink_api(**kwargs):
-        return evelink.api.API(base_url=current_app.config['EVEAPI_URL'], **kwargs)
+        if current_app.config['EVEAPI_CACHE_ENABLED']:
+            kwargs.setdefault('cache', EveApiManager.response_cache())
+        api = evelink.api.API(base_url=current_app.config['EVEAPI_URL'], **kwargs)
+        # evelink's requests transport reuses api.session when it is set
+        api.session = EveApiManager.http_session()
+        return api
+
+    @staticmethod
+    def get_key_info(api_id, api_key):
+        # APIKeyInfo carries the key type, mask, expiry and characters, so fetch it once
+        # per app context and let every check and character lookup read from that snapshot.
+        snapshots = getattr(g, 'eve_key_info', None)
+        if snapshots is None:
+            snapshots = g.eve_key_info = {}
+
+        key = (str(api_id), str(api_key))
+        if key not in snapshots:
+            snapshots[key] = None
+            try:
+                api = EveApiManager.evelink_api(api_key=(api_id, api_key))
+                account = evelink.account.Account(api=api)
+                snapshots[key] = account.key_info()
+            except evelink.api.APIError as error:
+                current_app.logger.error(error)
+
+        return snapshots[key]
 
     @staticmethod
     def get_characters_from_api(api_id, api_key):
         chars = []
-        try:
-            api = EveApiManager.evelink_api(api_key=(api_id, api_key))
-            # Should get characters
-            account = evelink.account.Account(api=api)
-            chars = account.characters()
-        except evelink.api.APIError as error:
-            current_app.logger.error(error)
+        info = EveApiManager.get_key_info(api_id, api_key)
+        if info:
+            characters = {}
+            for char_id, char in info.result['characters'].items():
+                char = dict(char)
+                # Characters outside an alliance come back as None, match account/Characters
+                if not char['alliance']:
+                    char['alliance'] = {'id': 0, 'name': None}
+                characters[char_id] = char
+            chars = evelink.api.APIResult(characters, info.timestamp, info.expires)
 
         return chars
 
@@ -51,7 +168,6 @@ class EveApiManager():
         return results
 
     @staticmethod
-    @cache_extension.cached(timeout=3600, key_prefix='get_alliance_info')
     def get_alliance_info():
         alliances = {}
         try:
@@ -79,68 +195,39 @@ class EveApiManager():
 
     @staticmethod
     def check_api_is_type_account(api_id, api_key):
-        try:
-            api = EveApiManager.evelink_api(api_key=(api_id, api_key))
-            account = evelink.account.Account(api=api)
-            info = account.key_info()
-            return info[0]['type'] == "account"
-
-        except evelink.api.APIError as error:
-            current_app.logger.error(error)
+        info = EveApiManager.get_key_info(api_id, api_key)
+        if info:
+            return info.result['type'] == "account"
 
         return False
 
     @staticmethod
     def check_api_is_full(api_id, api_key):
-        try:
-            api = EveApiManager.evelink_api(api_key=(api_id, api_key))
-            account = evelink.account.Account(api=api)
-            info = account.key_info()
-            return info[0]['access_mask'] == current_app.config['API_MASK']
-
-        except evelink.api.APIError as error:
-            current_app.logger.error(error)
+        info = EveApiManager.get_key_info(api_id, api_key)
+        if info:
+            return info.result['access_mask'] == current_app.config['API_MASK']
 
         return False
 
     @staticmethod
     def check_api_is_not_expire(api_id, api_key):
-        try:
-            api = EveApiManager.evelink_api(api_key=(api_id, api_key))
-            account = evelink.account.Account(api=api)
-            info = account.key_info()
-            return info[0]['expire_ts'] is None
-
-        except evelink.api.APIError as error:
-            current_app.logger.error(error)
+        info = EveApiManager.get_key_info(api_id, api_key)
+        if info:
+            return info.result['expire_ts'] is None
 
         return False
 
     @staticmethod
     def get_api_info(api_id, api_key):
-        try:
-            api = EveApiManager.evelink_api(api_key=(api_id, api_key))
-            account = evelink.account.Account(api=api)
-            info = account.key_info()
+        info = EveApiManager.get_key_info(api_id, api_key)
+        if info:
             return info
 
-        except evelink.api.APIError as error:
-            current_app.logger.error(error)
-
         return False
 
     @staticmethod
     def api_key_is_valid(api_id, api_key):
-        try:
-            api = EveApiManager.evelink_api(api_key=(api_id, api_key))
-            account = evelink.account.Account(api=api)
-            info = account.key_info()
-            return True
-        except evelink.api.APIError as error:
-            current_app.logger.error(error)
-            return False
-
-        return False
+        return bool(EveApiManager.get_key_info(api_id, api_key))
 
     @staticmethod
     def check_if_api_server_online():
@@ -198,6 +285,18 @@ class EveApiManager():
 
         return False
 
+    @staticmethod
+    def get_affiliations(character_ids):
+        results = {}
+        try:
+            api = EveApiManager.evelink_api()
+            eve = evelink.eve.EVE(api=api)
+            results = eve.affiliations_for_characters(character_ids)[0]
+        except evelink.api.APIError as error:
+            current_app.logger.error(error)
+
+        return results
+
     @staticmethod
     def check_if_character_is_in_corp(character_id, corp_id):
         try:
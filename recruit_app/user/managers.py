@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 from recruit_app.user.models import EveCharacter,\
-    EveApiKeyPair, EveAllianceInfo, EveCorporationInfo, User
+    EveApiKeyPair, EveAllianceInfo, EveCorporationInfo, User, previous_chars
 
 import datetime as dt
 
 from recruit_app.user.eve_api_manager import EveApiManager
 
-from recruit_app.extensions import bcrypt
+from recruit_app.extensions import bcrypt, db
+from recruit_app.database import commit_session, unit_of_work
+from recruit_app.recruit.dossier import DossierManager
 
 from redis import Redis
 redis_conn = Redis()
@@ -70,90 +72,111 @@ class EveManager:
 
 
     @staticmethod
-    def create_characters_from_list(chars, user, api_id):
+    def upsert_characters_from_list(chars, user, api_id):
+        # Load every affected character with one IN query and work out inserts and
+        # updates in memory.  Nothing is committed, the caller owns the transaction.
         errors = []
+        eve_chars = EveManager.get_characters_by_ids(chars.result.keys())
+        new_chars = []
+        reclaimed_ids = []
+
+        for char in chars.result.values():
+            eve_char = eve_chars.get(str(char['id']))
+            if not eve_char:
+                eve_char = EveCharacter()
+                eve_char.character_id = str(char['id'])
+                eve_char.character_name = char['name']
+                eve_char.corporation_id = str(char['corp']['id'])
+                eve_char.user_id = user.id
+                eve_char.api_id = api_id
+                new_chars.append(eve_char)
+                eve_chars[eve_char.character_id] = eve_char
+
+            elif eve_char.user_id is None or not eve_char.api_id:
+                # Character exists, but isn't associated with a user or an api_key
+                eve_char.character_name = char['name']
+                eve_char.corporation_id = str(char['corp']['id'])
+                eve_char.user_id = user.id
+                eve_char.api_id = api_id
+                reclaimed_ids.append(eve_char.character_id)
+
+            elif eve_char.api_id != api_id:
+                errors.append("Character {0} in use by API {1}".format(char['name'], eve_char.api_id))
+
+        # Same primary key on every row, so SQLAlchemy batches these into one executemany
+        db.session.add_all(new_chars)
+
+        if reclaimed_ids:
+            # A user taking a character back is no longer one of its previous owners
+            db.session.execute(previous_chars.delete().where(
+                (previous_chars.c.user_id == user.id) &
+                (previous_chars.c.character_id.in_(reclaimed_ids))))
+
+        return errors, eve_chars
 
-        for char in chars.result:
-            eveChar = EveManager.get_character_by_id(chars.result[char]['id'])
-            if not eveChar:
-                if EveManager.create_character(chars.result[char]['id'],
-                                            chars.result[char]['name'],
-                                            chars.result[char]['corp']['id'],
-                                            user.id, api_id):
-                    pass
-
-                else:
-                    errors.append("Character {0} creation failed".format(chars.result[char]['name']))
-
-            else:
-                if eveChar.user_id is None or not eveChar.api_id:
-                    # Character exists, but isn't associated with a user or an api_key
-                    if EveManager.update_character(chars.result[char]['id'],
-                                                chars.result[char]['name'],
-                                                chars.result[char]['corp']['id'],
-                                                user.id, api_id):
-                        pass
-
-                    else:
-                        errors.append("Character {0} update failed".format(chars.result[char]['name']))
-                else:
-                        errors.append("Character {0} in use by API {1}".format(chars.result[char]['name'], eveChar.api_id))
+    @staticmethod
+    def create_characters_from_list(chars, user, api_id):
+        errors, eve_chars = EveManager.upsert_characters_from_list(chars, user, api_id)
+        commit_session()
         return errors
 
 
     @staticmethod
     def create_corporations_from_character_list(characters):
-        for character in characters.result:
-            if not EveManager.get_corporation_info_by_id(characters.result[character]['corp']['id']):
-                corp_info = EveApiManager.get_corporation_information(characters.result[character]['corp']['id'])
-                if corp_info:
-                    EveManager.create_corporation_info(corporation_id=corp_info['id'],
-                                                       corp_name=corp_info['name'],
-                                                       corp_ticker=corp_info['ticker'],
-                                                       corp_member_count=corp_info['members']['current'],
-                                                       alliance_id=corp_info['alliance']['id'])
+        corp_ids = set(str(character['corp']['id']) for character in characters.result.values())
+        known = EveManager.get_corporation_infos_by_ids(corp_ids)
+        for corp_id in corp_ids - set(known):
+            corp_info = EveApiManager.get_corporation_information(corp_id)
+            if corp_info:
+                EveManager.create_corporation_info(corporation_id=corp_info['id'],
+                                                   corp_name=corp_info['name'],
+                                                   corp_ticker=corp_info['ticker'],
+                                                   corp_member_count=corp_info['members']['current'],
+                                                   alliance_id=corp_info['alliance']['id'])
 
 
     @staticmethod
     def create_alliances_from_list(characters):
-        for character in characters.result:
-            if characters.result[character]['alliance']['id'] != 0:
-                if not EveManager.get_alliance_info_by_id(characters.result[character]['alliance']['id']):
-                    alliance_info = EveApiManager.get_alliance_information(characters.result[character]['alliance']['id'])
-                    # print alliance_info
-                    if alliance_info:
-                        EveManager.create_alliance_info(alliance_id=alliance_info['id'],
-                                                        alliance_name=alliance_info['name'],
-                                                        alliance_ticker=alliance_info['ticker'],
-                                                        alliance_executor_corp_id=alliance_info['executor_id'],
-                                                        alliance_member_count=alliance_info['member_count'])
+        alliance_ids = set(str(character['alliance']['id']) for character in characters.result.values()
+                           if character['alliance']['id'] != 0)
+        known = EveManager.get_alliance_infos_by_ids(alliance_ids)
+        for alliance_id in alliance_ids - set(known):
+            alliance_info = EveApiManager.get_alliance_information(alliance_id)
+            if alliance_info:
+                EveManager.create_alliance_info(alliance_id=alliance_info['id'],
+                                                alliance_name=alliance_info['name'],
+                                                alliance_ticker=alliance_info['ticker'],
+                                                alliance_executor_corp_id=alliance_info['executor_id'],
+                                                alliance_member_count=alliance_info['member_count'])
 
 
     @staticmethod
     def update_characters_from_list(characters, user, api_id):
         EveManager.create_alliances_from_list(characters)
         EveManager.create_corporations_from_character_list(characters)
-        EveManager.create_characters_from_list(characters, user, api_id)
-
-        for character in characters.result:
-            eve_char = EveManager.get_character_by_id(characters.result[character]['id'])
-        
-            if eve_char:
-                if str(characters.result[character]['corp']['id']) != eve_char.corporation_id:
-                    eve_char.corporation_id = str(characters.result[character]['corp']['id'])
-
-                if str(characters.result[character]['alliance']['id']) != eve_char.corporation.alliance_id:
-                    if characters.result[character]['alliance']['id'] != 0:
-                        eve_char.corporation.alliance_id = str(characters.result[character]['alliance']['id'])
-                    else:
-                        eve_char.corporation.alliance_id = None
-                    
-                # Handle name changes (rare, but :CCP:)
-                if characters.result[character]['name'] != eve_char.character_name:
-                    eve_char.character_name = characters.result[character]['name']
+        errors, eve_chars = EveManager.upsert_characters_from_list(characters, user, api_id)
+
+        corps = EveManager.get_corporation_infos_by_ids(
+            str(character['corp']['id']) for character in characters.result.values())
+
+        for character in characters.result.values():
+            eve_char = eve_chars[str(character['id'])]
 
-                eve_char.save()
+            if str(character['corp']['id']) != eve_char.corporation_id:
+                eve_char.corporation_id = str(character['corp']['id'])
 
+            corp = corps.get(eve_char.corporation_id)
+            if corp:
+                alliance_id = str(character['alliance']['id']) if character['alliance']['id'] != 0 else None
+                if alliance_id != corp.alliance_id:
+                    corp.alliance_id = alliance_id
+
+            # Handle name changes (rare, but :CCP:)
+            if character['name'] != eve_char.character_name:
+                eve_char.character_name = character['name']
+
+        commit_session()
+        return errors
 
     @staticmethod
     def create_api_keypair(api_id, api_key, user_id):
@@ -164,12 +187,14 @@ class EveManager:
             api_pair.last_update_time = dt.datetime.utcnow()
             api_pair.user_id = user_id
             api_pair.save()
+            DossierManager.invalidate_user(user_id)
             return True
         else:
             return False
 
 
     @staticmethod
+    @unit_of_work()
     def update_api_keypair(api_id, api_key):
         # print "api update"
         api_pair = EveApiKeyPair.query.filter_by(api_id=api_id).first()
@@ -184,33 +209,43 @@ class EveManager:
                                                    api_id=api_pair.api_id)
                                                    
             # Now, archive any characters that don't exist anymore
-            for old_api_char in api_pair.characters:
-                found = False
-                for char in characters.result:
-                    if str(characters.result[char]['id']) == str(old_api_char.character_id):
-                        found = True
-                        break
-                if not found:
-                    for char in api_pair.user.previous_chars:
-                        if str(old_api_char.character_id) == str(char.character_id):
-                            found = True
-                            break
-                    if not found:
-                        api_pair.user.previous_chars.append(old_api_char)
-                    if str(api_pair.user.main_character_id) == str(old_api_char.character_id):
-                        api_pair.user.main_character_id = None
-                    api_pair.user.save(commit=False)
-                    old_api_char.user_id = None
-                    old_api_char.api_id = None
-                    old_api_char.save(commit=False)                
-            
+            current_ids = set(str(char_id) for char_id in characters.result)
+            archived_ids = [char.character_id for char in api_pair.characters if char.character_id not in current_ids]
+            if archived_ids:
+                EveManager.archive_characters(api_pair, archived_ids)
+
             api_pair.last_update_time = dt.datetime.utcnow()
             api_pair.save()
+            DossierManager.invalidate_user(api_pair.user_id)
             return True
 
         return False
 
 
+    @staticmethod
+    def archive_characters(api_pair, character_ids):
+        # Move characters that left an api key into the owner's history with a fixed
+        # number of queries, however many characters the account holds.
+        user = api_pair.user
+        if user:
+            known = set(row.character_id for row in db.session.query(previous_chars.c.character_id).filter(
+                previous_chars.c.user_id == user.id,
+                previous_chars.c.character_id.in_(character_ids)))
+            history = [{'user_id': user.id, 'character_id': character_id}
+                       for character_id in character_ids if character_id not in known]
+            if history:
+                db.session.execute(previous_chars.insert(), history)
+
+            if str(user.main_character_id) in character_ids:
+                user.main_character_id = None
+                user.save(commit=False)
+
+        EveCharacter.query.filter(
+            EveCharacter.api_id == api_pair.api_id,
+            EveCharacter.character_id.in_(character_ids)).update(
+            {'user_id': None, 'api_id': None}, synchronize_session=False)
+
+
     @staticmethod
     def create_alliance_info(alliance_id, alliance_name, alliance_ticker, alliance_executor_corp_id,
                              alliance_member_count, is_blue=None):
@@ -253,6 +288,62 @@ class EveManager:
             corp_info.alliance_id = alliance_id
             corp_info.save()
 
+    @staticmethod
+    def sync_alliance_directory(alliances):
+        # alliances is the eve.alliances() result: every alliance in EVE with its member corps.
+        # Diff it against what we store and write back only the rows that changed.
+        corp_alliance = {}
+        for alliance in alliances.values():
+            for corp_id in alliance['member_corps']:
+                corp_alliance[str(corp_id)] = str(alliance['id'])
+
+        stored_alliances = dict((alliance.alliance_id, alliance) for alliance in EveAllianceInfo.query)
+        stored_corps = db.session.query(EveCorporationInfo.corporation_id, EveCorporationInfo.alliance_id).all()
+
+        corp_updates = []
+        for corp_id, alliance_id in stored_corps:
+            new_alliance_id = corp_alliance.get(corp_id)
+            if new_alliance_id != alliance_id:
+                corp_updates.append({'corporation_id': corp_id, 'alliance_id': new_alliance_id})
+
+        # Keep the alliances we already track plus any our corps have just joined
+        wanted = set(stored_alliances) | set(corp_alliance.get(corp_id) for corp_id, _ in stored_corps)
+        wanted.discard(None)
+
+        alliance_inserts = []
+        alliance_updates = []
+        for alliance_id in wanted:
+            remote = alliances.get(int(alliance_id))
+            if not remote:
+                continue
+            row = {'alliance_id': alliance_id,
+                   'alliance_name': remote['name'],
+                   'alliance_ticker': remote['ticker'],
+                   'executor_corp_id': str(remote['executor_id']),
+                   'member_count': remote['member_count']}
+            stored = stored_alliances.get(alliance_id)
+            if stored is None:
+                alliance_inserts.append(row)
+            elif any(getattr(stored, key) != value for key, value in row.items()):
+                alliance_updates.append(row)
+
+        # Alliances first so corp foreign keys resolve
+        db.session.bulk_insert_mappings(EveAllianceInfo, alliance_inserts)
+        db.session.bulk_update_mappings(EveAllianceInfo, alliance_updates)
+        db.session.bulk_update_mappings(EveCorporationInfo, corp_updates)
+        commit_session()
+
+        return len(alliance_inserts), len(alliance_updates), len(corp_updates)
+
+    @staticmethod
+    def update_corporation_member_counts(member_counts):
+        corps = EveManager.get_corporation_infos_by_ids(member_counts.keys())
+        updates = [{'corporation_id': corp_id, 'member_count': count}
+                   for corp_id, count in member_counts.items()
+                   if corp_id in corps and corps[corp_id].member_count != count]
+        db.session.bulk_update_mappings(EveCorporationInfo, updates)
+        commit_session()
+
     @staticmethod
     def get_api_key_pairs(user):
         return EveApiKeyPair.query.filter_by(user_id=user.id).all()
@@ -265,6 +356,7 @@ class EveManager:
             return False
 
     @staticmethod
+    @unit_of_work()
     def delete_api_key_pair(api_id, user):
         api_key_pair = EveApiKeyPair.query.filter_by(api_id=api_id).first()
         if api_key_pair:
@@ -294,6 +386,7 @@ class EveManager:
                     char.save()
                 
                 api_key_pair.delete()
+                DossierManager.invalidate_user(user.id)
 
 
     @staticmethod
@@ -304,6 +397,14 @@ class EveManager:
     def get_character_by_id(character_id):
         return EveCharacter.query.filter_by(character_id=str(character_id)).first()
 
+    @staticmethod
+    def get_characters_by_ids(character_ids):
+        character_ids = [str(character_id) for character_id in character_ids]
+        if not character_ids:
+            return {}
+        return dict((char.character_id, char) for char in
+                    EveCharacter.query.filter(EveCharacter.character_id.in_(character_ids)))
+
     @staticmethod
     def get_character_alliance_id_by_character_id(char_id):
         if EveCharacter.query.filter_by(character_id=str(char_id)).all():
@@ -327,6 +428,22 @@ class EveManager:
     def get_corporation_info_by_id(corp_id):
         return EveCorporationInfo.query.filter_by(corporation_id=str(corp_id)).first()
 
+    @staticmethod
+    def get_alliance_infos_by_ids(alliance_ids):
+        alliance_ids = [str(alliance_id) for alliance_id in alliance_ids]
+        if not alliance_ids:
+            return {}
+        return dict((alliance.alliance_id, alliance) for alliance in
+                    EveAllianceInfo.query.filter(EveAllianceInfo.alliance_id.in_(alliance_ids)))
+
+    @staticmethod
+    def get_corporation_infos_by_ids(corp_ids):
+        corp_ids = [str(corp_id) for corp_id in corp_ids]
+        if not corp_ids:
+            return {}
+        return dict((corp.corporation_id, corp) for corp in
+                    EveCorporationInfo.query.filter(EveCorporationInfo.corporation_id.in_(corp_ids)))
+
     @staticmethod
     def get_all_corporation_info():
         return EveCorporationInfo.query.order_by(EveCorporationInfo.corporation_id)
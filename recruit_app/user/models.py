@@ -4,7 +4,7 @@ import datetime as dt
 from flask_security import UserMixin, RoleMixin
 from flask_security.utils import verify_and_update_password, encrypt_password
 from recruit_app.extensions import bcrypt
-from recruit_app.database import Column, db, Model, ReferenceCol, relationship, SurrogatePK, TimeMixin
+from recruit_app.database import Column, db, Model, ReferenceCol, relationship, SurrogatePK, TimeMixin, trigram_index
 
 roles_users = db.Table('roles_users',
         db.Column('user_id', db.Integer(), db.ForeignKey('users.id')),
@@ -92,6 +92,8 @@ class EveCharacter(Model, TimeMixin):
     def __str__(self):
         return self.character_name
 
+trigram_index('ix_characters_character_name_trgm', EveCharacter.__table__.c.character_name)
+
 
 class EveApiKeyPair(Model):
     __tablename__ = 'api_key_pairs'
@@ -132,7 +134,7 @@ class EveCorporationInfo(Model):
     member_count = Column(db.Integer)
     is_blue = Column(db.Boolean, default=False)
     alliance_id = ReferenceCol('alliances', pk_name='alliance_id', nullable=True)
-    alliance = relationship('EveAllianceInfo', backref='corporations', foreign_keys=[alliance_id])
+    alliance = relationship('EveAllianceInfo', backref='corporations', foreign_keys=[alliance_id], lazy='joined')
 
     def __str__(self):
         return self.corporation_name
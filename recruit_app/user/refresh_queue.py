@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+from recruit_app.user.models import EveApiKeyPair
+from recruit_app.recruit.models import HrApplication, CLOSED_APPLICATION_STATES
+from recruit_app.extensions import db
+
+from flask import current_app
+from flask_rq import get_connection
+
+import calendar
+import time
+import redis
+
+# Sorted set of api_id -> unix time the key is next due for a refresh
+QUEUE_KEY = 'api_key_refresh_queue'
+
+
+def _zadd(pipe, mapping):
+    # redis-py 3 takes a mapping, older clients take member=score keywords
+    if redis.VERSION >= (3, 0):
+        pipe.zadd(QUEUE_KEY, mapping)
+    else:
+        pipe.zadd(QUEUE_KEY, **mapping)
+
+
+class ApiKeyRefreshQueue:
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def connection():
+        return get_connection()
+
+    @staticmethod
+    def schedule(api_ids, due=None):
+        if not api_ids:
+            return
+        due = time.time() if due is None else due
+        pipe = ApiKeyRefreshQueue.connection().pipeline()
+        _zadd(pipe, dict((str(api_id), due) for api_id in api_ids))
+        pipe.execute()
+
+    @staticmethod
+    def remove(api_ids):
+        if api_ids:
+            ApiKeyRefreshQueue.connection().zrem(QUEUE_KEY, *[str(api_id) for api_id in api_ids])
+
+    @staticmethod
+    def boost_user(user_id):
+        # Pull a user's keys to the front of the queue, e.g. when they apply
+        api_ids = [row.api_id for row in db.session.query(EveApiKeyPair.api_id).filter_by(user_id=user_id)]
+        ApiKeyRefreshQueue.schedule(api_ids)
+
+    @staticmethod
+    def boosted_api_ids(api_ids=None):
+        # Keys owned by anyone with an application still being worked
+        query = db.session.query(EveApiKeyPair.api_id).join(
+            HrApplication, HrApplication.user_id == EveApiKeyPair.user_id).filter(
+            HrApplication.hidden == False,
+            ~HrApplication.approved_denied.in_(CLOSED_APPLICATION_STATES))
+        if api_ids is not None:
+            query = query.filter(EveApiKeyPair.api_id.in_(api_ids))
+        return set(row.api_id for row in query.distinct())
+
+    @staticmethod
+    def next_due(last_update_time, boosted):
+        if boosted:
+            interval = current_app.config['API_KEY_REFRESH_BOOSTED_INTERVAL']
+        else:
+            interval = current_app.config['API_KEY_REFRESH_INTERVAL']
+        if last_update_time is None:
+            return time.time()
+        return calendar.timegm(last_update_time.utctimetuple()) + interval
+
+    @staticmethod
+    def seed():
+        """Bring the queue in line with the key table.
+
+        New keys are queued from their last_update_time, keys of open applicants are
+        pulled forward to the boosted interval and deleted keys are dropped.
+        """
+        conn = ApiKeyRefreshQueue.connection()
+        queued = dict((api_id, score) for api_id, score in conn.zrange(QUEUE_KEY, 0, -1, withscores=True))
+        keys = db.session.query(EveApiKeyPair.api_id, EveApiKeyPair.last_update_time).all()
+        boosted = ApiKeyRefreshQueue.boosted_api_ids()
+
+        updates = {}
+        for api_id, last_update_time in keys:
+            due = ApiKeyRefreshQueue.next_due(last_update_time, api_id in boosted)
+            current = queued.pop(str(api_id), None)
+            if current is None or due < current:
+                updates[str(api_id)] = due
+
+        pipe = conn.pipeline()
+        if updates:
+            _zadd(pipe, updates)
+        if queued:
+            pipe.zrem(QUEUE_KEY, *queued.keys())
+        pipe.execute()
+
+    @staticmethod
+    def claim(count):
+        """Take up to count of the most overdue keys and push them back one interval.
+
+        Claiming reschedules the keys in the same transaction, so overlapping ticks
+        never hand out the same key twice and a key that fails is retried next interval.
+        """
+        now = time.time()
+        interval = current_app.config['API_KEY_REFRESH_INTERVAL']
+
+        def _claim(pipe):
+            api_ids = pipe.zrangebyscore(QUEUE_KEY, '-inf', now, start=0, num=count)
+            pipe.multi()
+            if api_ids:
+                _zadd(pipe, dict((api_id, now + interval) for api_id in api_ids))
+            return api_ids
+
+        api_ids = ApiKeyRefreshQueue.connection().transaction(_claim, QUEUE_KEY, value_from_callable=True)
+
+        # Open applications come round again sooner
+        boosted = ApiKeyRefreshQueue.boosted_api_ids(api_ids) if api_ids else set()
+        ApiKeyRefreshQueue.schedule(boosted, now + current_app.config['API_KEY_REFRESH_BOOSTED_INTERVAL'])
+
+        return api_ids
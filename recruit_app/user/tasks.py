@@ -1,10 +1,11 @@
 from recruit_app.user.models import EveCharacter, EveCorporationInfo, EveAllianceInfo, EveApiKeyPair
 from recruit_app.user.managers import EveManager
 from recruit_app.user.eve_api_manager import EveApiManager
+from recruit_app.user.refresh_queue import ApiKeyRefreshQueue
 
 from flask_rq import job, get_worker
 from flask import current_app
-from recruit_app.extensions import rq
+from recruit_app.extensions import rq, db
 
 from redis import Redis
 import time
@@ -14,43 +15,104 @@ import time
 
 
 @job('low')
-def run_alliance_corp_update():
+def run_alliance_corp_update(inline=False):
+    """Sync alliances and corp memberships from one alliance list, then refresh corps in shards.
+
+    The alliance list carries every alliance's member corps, so alliance rows and
+    corp alliance ids come from a single upstream call.  Only member counts still
+    need a corporation sheet per corp.
+    """
     with current_app.app_context():
         if EveApiManager.check_if_api_server_online():
-            corporations = EveCorporationInfo.query.all()
-            for corp in corporations:
-                corp_info = EveApiManager.get_corporation_information(corp.corporation_id)
-                if corp_info:
-                    # Set alliance info first to set foreign key
-                    if corp_info['alliance']['id']:
-                        alliance_info = EveApiManager.get_alliance_information(corp_info['alliance']['id'])
-                        if alliance_info:
-                            if not EveAllianceInfo.query.filter_by(alliance_id=str(alliance_info['id'])).first():
-                                EveManager.create_alliance_info(alliance_id=alliance_info['id'],
-                                    alliance_name=alliance_info['name'],
-                                    alliance_ticker=alliance_info['ticker'],
-                                    alliance_executor_corp_id=alliance_info['executor_id'],
-                                    alliance_member_count=alliance_info['member_count'])
-                            else:
-                                EveManager.update_alliance_info(alliance_id=alliance_info['id'],
-                                    alliance_executor_corp_id=alliance_info['executor_id'],
-                                    alliance_member_count=alliance_info['member_count'])
-                    EveManager.update_corporation_info(corporation_id=corp_info['id'],
-                        corp_member_count=corp_info['members']['current'],
-                        alliance_id=corp_info['alliance']['id'])
+            alliances = EveApiManager.get_alliance_info()
+            if alliances:
+                EveManager.sync_alliance_directory(alliances.result)
+
+            shard_size = current_app.config['CORPORATION_UPDATE_SHARD_SIZE']
+            corp_ids = [row.corporation_id for row in
+                        db.session.query(EveCorporationInfo.corporation_id).order_by(EveCorporationInfo.corporation_id)]
+            for start in range(0, len(corp_ids), shard_size):
+                shard = corp_ids[start:start + shard_size]
+                if inline:
+                    run_corporation_update_shard(shard)
+                else:
+                    run_corporation_update_shard.delay(shard)
 
 
 @job('low')
-def run_api_key_update():
+def run_corporation_update_shard(corp_ids):
+    with current_app.app_context():
+        member_counts = {}
+        for corp_id in corp_ids:
+            try:
+                corp_info = EveApiManager.get_corporation_information(corp_id)
+            except Exception:
+                current_app.logger.exception("Failed to fetch corporation {0}".format(corp_id))
+                continue
+            if corp_info:
+                member_counts[corp_id] = corp_info['members']['current']
+
+        EveManager.update_corporation_member_counts(member_counts)
+
+
+@job('low')
+def run_api_key_update(inline=False):
+    """Split the api key table into shards and refresh each shard as its own job.
+
+    Shards are enqueued on the low queue so they spread across however many rq
+    workers are running.  Pass inline=True to refresh every shard in this process.
+    """
     with current_app.app_context():
-        # I am not proud of this block of code
         if EveApiManager.check_if_api_server_online():
-            api_keys = EveApiKeyPair.query.order_by(EveApiKeyPair.api_id).all()
-            for api_key in api_keys:
-                if EveApiManager.check_api_is_not_expire(api_key.api_id, api_key.api_key):
-                    EveManager.update_api_keypair(
-                        api_key.api_id, api_key.api_key)
-                    current_app.logger.debug("Updating {0}".format(api_key.api_id))
+            shard_size = current_app.config['API_KEY_UPDATE_SHARD_SIZE']
+            api_ids = [row.api_id for row in db.session.query(EveApiKeyPair.api_id).order_by(EveApiKeyPair.api_id)]
+            for start in range(0, len(api_ids), shard_size):
+                shard = api_ids[start:start + shard_size]
+                if inline:
+                    run_api_key_update_shard(shard)
                 else:
-                    current_app.logger.debug("Removing expired api_key {0} {1}".format(api_key.api_id, api_key.api_key))
-                    EveManager.delete_api_key_pair(api_key.api_id, None)
+                    run_api_key_update_shard.delay(shard)
+            current_app.logger.debug("Queued {0} api keys in shards of {1}".format(len(api_ids), shard_size))
+
+
+@job('low')
+def run_api_key_update_shard(api_ids):
+    with current_app.app_context():
+        api_keys = EveApiKeyPair.query.filter(EveApiKeyPair.api_id.in_(api_ids)).order_by(EveApiKeyPair.api_id).all()
+        for api_key in api_keys:
+            # A bad key or a flaky response must not take the rest of the shard down with it
+            try:
+                refresh_api_key(api_key.api_id, api_key.api_key)
+            except Exception:
+                db.session.rollback()
+                current_app.logger.exception("Failed to update api_key {0}".format(api_key.api_id))
+
+
+@job('low')
+def run_api_key_refresh_tick():
+    """Refresh the most overdue keys in the staleness queue.
+
+    Scheduled every minute, so the EVE API and the database see a steady trickle
+    of API_KEY_REFRESH_BATCH keys instead of the whole table every few hours.
+    """
+    with current_app.app_context():
+        if EveApiManager.check_if_api_server_online():
+            api_ids = ApiKeyRefreshQueue.claim(current_app.config['API_KEY_REFRESH_BATCH'])
+            if api_ids:
+                run_api_key_update_shard.delay(api_ids)
+
+
+@job('low')
+def run_api_key_refresh_seed():
+    with current_app.app_context():
+        ApiKeyRefreshQueue.seed()
+
+
+def refresh_api_key(api_id, api_key):
+    if EveApiManager.check_api_is_not_expire(api_id, api_key):
+        EveManager.update_api_keypair(api_id, api_key)
+        current_app.logger.debug("Updating {0}".format(api_id))
+    else:
+        current_app.logger.debug("Removing expired api_key {0} {1}".format(api_id, api_key))
+        EveManager.delete_api_key_pair(api_id, None)
+        ApiKeyRefreshQueue.remove([api_id])
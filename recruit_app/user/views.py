@@ -7,6 +7,7 @@ from recruit_app.user.eve_api_manager import EveApiManager
 from recruit_app.user.forms import UpdateKeyForm
 
 from recruit_app.user.models import EveCharacter, EveAllianceInfo, EveApiKeyPair
+from recruit_app.database import unit_of_work
 
 import datetime as dt
 
@@ -27,13 +28,17 @@ def api_add():
         characters = EveApiManager.get_characters_from_api(form.data['api_id'],
                                                                form.data['api_key'])
 
-        if EveManager.create_api_keypair(form.data['api_id'],
-                                          form.data['api_key'],
-                                          current_user.get_id()):
-            EveManager.create_alliances_from_list(characters)
-            EveManager.create_corporations_from_character_list(characters)
+        with unit_of_work():
+            key_created = EveManager.create_api_keypair(form.data['api_id'],
+                                                        form.data['api_key'],
+                                                        current_user.get_id())
+            if key_created:
+                EveManager.create_alliances_from_list(characters)
+                EveManager.create_corporations_from_character_list(characters)
 
-            character_creation = EveManager.create_characters_from_list(characters, current_user, form.data['api_id'])
+                character_creation = EveManager.create_characters_from_list(characters, current_user, form.data['api_id'])
+
+        if key_created:
             if character_creation:
                 flash(character_creation, category="message")
             # else:
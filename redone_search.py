@@ -17,19 +17,28 @@ from __future__ import absolute_import
 
 
 import flask.ext.sqlalchemy as flask_sqlalchemy
+from flask import current_app
+from flask_rq import job, get_connection
+from redis import RedisError
 
 import sqlalchemy
+from sqlalchemy.dialects import postgresql
 
 from whoosh.qparser import OrGroup
 from whoosh.qparser import AndGroup
 from whoosh.qparser import MultifieldParser
 from whoosh.analysis import StemmingAnalyzer
 import whoosh.index
+import whoosh.writing
 from whoosh.fields import Schema
 #from whoosh.fields import ID, TEXT, KEYWORD, STORED
 
-import heapq
+import datetime
+import json
+import multiprocessing
 import os
+import shutil
+import threading
 
 
 __searchable__ = '__searchable__'
@@ -37,11 +46,16 @@ __searchable__ = '__searchable__'
 
 DEFAULT_WHOOSH_INDEX_NAME = 'whoosh_index'
 
+# Redis set of changed primary keys per model, and the flag for its queued job
+PENDING_KEY = 'whoosh:pending:{0}'
+SCHEDULED_KEY = 'whoosh:scheduled:{0}'
+
 
 class _QueryProxy(flask_sqlalchemy.BaseQuery):
     # We're replacing the model's ``query`` field with this proxy. The main
-    # thing this proxy does is override the __iter__ method so that results are
-    # returned in the order of the whoosh score to reflect text-based ranking.
+    # thing this proxy adds is ``whoosh_search``, which filters to the Whoosh
+    # hits and orders them by rank in SQL, so the result is still an ordinary
+    # query that can be paginated or streamed.
 
     def __init__(self, entities, session=None):
         super(_QueryProxy, self).__init__(entities, session)
@@ -50,46 +64,6 @@ class _QueryProxy(flask_sqlalchemy.BaseQuery):
         self._primary_key_name = self._modelclass.whoosh_primary_key
         self._whoosh_searcher = self._modelclass.pure_whoosh
 
-        # Stores whoosh results from query. If ``None``, indicates that no
-        # whoosh query was performed.
-        self._whoosh_rank = None
-
-    def __iter__(self):
-        ''' Reorder ORM-db results according to Whoosh relevance score. '''
-
-        super_iter = super(_QueryProxy, self).__iter__()
-
-        if self._whoosh_rank is None:
-            # Whoosh search hasn't been run so behave as normal.
-
-            return super_iter
-
-        super_rows = list(super_iter)
-
-        # Iterate through the values and re-order by whoosh relevance.
-        ordered_by_whoosh_rank = []
-
-        for row in super_rows:
-            # Push items onto heap, where sort value is the rank provided by
-            # Whoosh
-            #
-            #  heapq.heappush(ordered_by_whoosh_rank,
-            #     (self._whoosh_rank[unicode(getattr(row,
-            #         self._primary_key_name))], row))
-            if hasattr(row, self._primary_key_name):
-                heapq.heappush(ordered_by_whoosh_rank,
-                               (self._whoosh_rank[unicode(getattr(row,
-                               self._primary_key_name))], row))
-            else:
-                # PK column not found in result row
-                return iter(super_rows)
-
-        def _inner():
-            while ordered_by_whoosh_rank:
-                yield heapq.heappop(ordered_by_whoosh_rank)[1]
-
-        return _inner()
-
     def whoosh_search(self, query, limit=None, fields=None, or_=False):
         '''
 
@@ -113,52 +87,58 @@ class _QueryProxy(flask_sqlalchemy.BaseQuery):
         if not isinstance(query, unicode):
             query = unicode(query)
 
-        results = self._whoosh_searcher(query, limit, fields, or_)
-
-        if not results:
-            # We don't want to proceed with empty results because we get a
-            # stderr warning from sqlalchemy when executing 'in_' on empty set.
-            # However we cannot just return an empty list because it will not
-            # be a query.
+        column = getattr(self._modelclass, self._primary_key_name)
+        python_type = column.property.columns[0].type.python_type
+        ranked = [python_type(pk) for pk in
+                  self._whoosh_searcher.keys(query, limit, fields, or_)]
 
-            # XXX is this efficient?
-            return self.filter('null')
+        if not ranked:
+            # An empty ``in_`` makes sqlalchemy warn, but we still have to
+            # return a query.
+            return self.filter(sqlalchemy.sql.false())
 
-        result_set = set()
-        result_ranks = {}
-
-        for rank, result in enumerate(results):
-            pk = result[self._primary_key_name]
-            result_set.add(pk)
-            result_ranks[pk] = rank
-
-        f = self.filter(getattr(self._modelclass,
-            self._primary_key_name).in_(result_set))
-
-        f._whoosh_rank = result_ranks
-
-        return f
+        # Position in the hit list is the rank, the database does the sorting
+        return self.filter(column.in_(ranked)).order_by(
+            sqlalchemy.func.array_position(postgresql.array(ranked), column))
 
 
 class _Searcher(object):
     ''' Assigned to a Model class as ``pure_search``, which enables
-    text-querying to whoosh hit list. Also used by ``query.whoosh_search``'''
+    text-querying to whoosh hit list. Also used by ``query.whoosh_search``
+
+    Searchers are kept per thread and only reopened when a writer has
+    committed a new generation of the index since they were opened.'''
 
     def __init__(self, primary, indx):
         self.primary_key_name = primary
         self._index = indx
-        self.searcher = indx.searcher()
+        self._local = threading.local()
         self._all_fields = list(set(indx.schema._fields.keys()) -
                 set([self.primary_key_name]))
 
+    @property
+    def searcher(self):
+        searcher = getattr(self._local, 'searcher', None)
+        if searcher is None:
+            searcher = self._index.searcher()
+        elif not searcher.up_to_date():
+            # Reuses the readers of segments that didn't change
+            searcher = searcher.refresh()
+        self._local.searcher = searcher
+        return searcher
+
     def __call__(self, query, limit=None, fields=None, or_=False):
         if fields is None:
             fields = self._all_fields
 
         group = OrGroup if or_ else AndGroup
         parser = MultifieldParser(fields, self._index.schema, group=group)
-        return self._index.searcher().search(parser.parse(query),
-                limit=limit)
+        return self.searcher.search(parser.parse(query), limit=limit)
+
+    def keys(self, query, limit=None, fields=None, or_=False):
+        ''' Primary keys of the hits, best first. '''
+        return [hit[self.primary_key_name] for hit in
+                self(query, limit, fields, or_)]
 
 
 def whoosh_index(app, model):
@@ -171,8 +151,10 @@ def whoosh_index(app, model):
     if not hasattr(app, 'whoosh_indexes'):
         app.whoosh_indexes = {}
 
-    return app.whoosh_indexes.get(model.__name__,
-                _create_index(app, model))
+    # Only create on a miss, reopening would throw away the cached searchers
+    if model.__name__ in app.whoosh_indexes:
+        return app.whoosh_indexes[model.__name__]
+    return _create_index(app, model)
 
 
 def _create_index(app, model):
@@ -232,41 +214,277 @@ def _get_whoosh_schema_and_primary_key(model):
 
 
 def _after_flush(app, changes):
-    # Any db updates go through here. We check if any of these models have
-    # ``__searchable__`` fields, indicating they need to be indexed. With these
-    # we update the whoosh index for the model. If no index exists, it will be
-    # created here; this could impose a penalty on the initial commit of a
-    # model.
+    # Any db updates go through here. We only note the primary keys of changed
+    # ``__searchable__`` models in a Redis set per model and leave the Whoosh
+    # writes to ``index_pending`` on an rq worker, so commits never wait on the
+    # index lock. Keys that change again before the worker gets to them are
+    # deduplicated by the set and land in the same batch.
 
-    bytype = {}  # sort changes by type so we can use per-model writer
+    bytype = {}  # sort changes by type so each model gets one batch
     for change in changes:
-        update = change[1] in ('update', 'insert')
-
-        if hasattr(change[0].__class__, __searchable__):
-            bytype.setdefault(change[0].__class__.__name__, []).append((update,
-                change[0]))
-
-    for model, values in bytype.iteritems():
-        index = whoosh_index(app, values[0][1].__class__)
-        with index.writer() as writer:
-            primary_field = values[0][1].pure_whoosh.primary_key_name
-            searchable = values[0][1].__searchable__
-
-            for update, v in values:
-                if update:
-                    attrs = {}
-                    for key in searchable:
-                        try:
-                            attrs[key] = unicode(getattr(v, key))
-                        except AttributeError:
-                            raise AttributeError('{0} does not have {1} field {2}'
-                                    .format(model, __searchable__, key))
-
-                    attrs[primary_field] = unicode(getattr(v, primary_field))
-                    writer.update_document(**attrs)
-                else:
-                    writer.delete_by_term(primary_field, unicode(getattr(v,
-                        primary_field)))
+        model = change[0].__class__
+        if hasattr(model, __searchable__):
+            primary_field = _get_primary_key_name(model)
+            bytype.setdefault(model.__name__, set()).add(
+                unicode(getattr(change[0], primary_field)))
+
+    if not bytype:
+        return
+
+    try:
+        conn = get_connection()
+        pipe = conn.pipeline()
+        for model, keys in bytype.iteritems():
+            pipe.sadd(PENDING_KEY.format(model), *keys)
+        pipe.execute()
+
+        for model in bytype:
+            # One job in flight per model, later commits just grow its batch
+            if conn.set(SCHEDULED_KEY.format(model), 1, nx=True,
+                        ex=app.config.get('WHOOSH_INDEX_JOB_TIMEOUT', 600)):
+                index_pending.delay(model)
+    except RedisError as error:
+        # The commit already happened, an incremental reindex picks these up
+        app.logger.warning(error)
+
+
+@job('low')
+def index_pending(model_name):
+    ''' Apply the pending changes of one model to its index with a single
+    writer. Rows still in the database are (re)indexed, missing ones deleted.'''
+
+    app = current_app._get_current_object()
+    with app.app_context():
+        conn = get_connection()
+        pending = PENDING_KEY.format(model_name)
+
+        # Clear the flag before taking the batch, anything committed from here
+        # on schedules the next job instead of being missed
+        conn.delete(SCHEDULED_KEY.format(model_name))
+        pipe = conn.pipeline()
+        pipe.smembers(pending)
+        pipe.delete(pending)
+        keys = pipe.execute()[0]
+        if not keys:
+            return
+
+        try:
+            model = app.extensions['sqlalchemy'].db.Model._decl_class_registry[model_name]
+            _index_keys(app, model, keys)
+        except:
+            # Put the batch back for the next run rather than lose it
+            conn.sadd(pending, *keys)
+            raise
+
+
+def _index_keys(app, model, keys):
+    index = whoosh_index(app, model)
+    primary_field = _get_primary_key_name(model)
+    keys = set(unicode(key) for key in keys)
+
+    rows = model.query.filter(
+        getattr(model, primary_field).in_(list(keys))).all()
+
+    with index.writer(timeout=app.config.get('WHOOSH_WRITER_TIMEOUT', 60)) as writer:
+        for row in rows:
+            attrs = _document(model, row, primary_field)
+            keys.discard(attrs[primary_field])
+            writer.update_document(**attrs)
+
+        for key in keys:
+            writer.delete_by_term(primary_field, key)
+
+
+def _document(model, row, primary_field):
+    attrs = {}
+    for key in model.__searchable__:
+        try:
+            attrs[key] = unicode(getattr(row, key))
+        except AttributeError:
+            raise AttributeError('{0} does not have {1} field {2}'
+                    .format(model.__name__, __searchable__, key))
+
+    attrs[primary_field] = unicode(getattr(row, primary_field))
+    return attrs
+
+
+def _get_primary_key_name(model):
+    for field in model.__table__.columns:
+        if field.primary_key:
+            return field.name
+
+
+def searchable_models(app):
+    ''' Every mapped model of ``app`` with ``__searchable__`` fields, by name. '''
+    registry = app.extensions['sqlalchemy'].db.Model._decl_class_registry
+    return dict((name, model) for name, model in registry.items()
+                if isinstance(model, type) and hasattr(model, __searchable__))
+
+
+def _state_path(app, model, name):
+    return os.path.join(app.config.get('WHOOSH_BASE', DEFAULT_WHOOSH_INDEX_NAME),
+            '{0}.{1}'.format(model.__name__, name))
+
+
+def _load_state(path, default):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return default
+
+
+def _save_state(path, state):
+    # Write then rename, a crash never leaves a half written checkpoint
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.rename(path + '.tmp', path)
+
+
+def _partitions(model, primary_field, count):
+    column = getattr(model, primary_field)
+    low, high = model.query.with_entities(
+        sqlalchemy.func.min(column), sqlalchemy.func.max(column)).one()
+    if low is None:
+        return []
+    if not isinstance(low, (int, long)):
+        raise ValueError('{0} needs an integer primary key to be partitioned'
+                .format(model.__name__))
+
+    size = max(1, (high - low + count) // count)
+    return [[start, min(start + size, high + 1)]
+            for start in range(low, high + 1, size)]
+
+
+# Set before the pool forks, workers inherit the app and model
+_reindex_app = None
+_reindex_model = None
+
+
+def _build_partition(args):
+    number, start, stop, directory = args
+    app, model = _reindex_app, _reindex_model
+    with app.app_context():
+        db = app.extensions['sqlalchemy'].db
+        # Connections inherited from the parent can't be shared across processes
+        db.engine.dispose()
+
+        primary_field = _get_primary_key_name(model)
+        column = getattr(model, primary_field)
+        schema, _ = _get_whoosh_schema_and_primary_key(model)
+
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+        indx = whoosh.index.create_in(directory, schema)
+
+        rows = 0
+        with indx.writer(limitmb=app.config.get('WHOOSH_REINDEX_LIMITMB', 256)) as writer:
+            query = model.query.filter(column >= start, column < stop).order_by(column)
+            for row in query.yield_per(app.config.get('WHOOSH_REINDEX_BATCH', 1000)):
+                writer.add_document(**_document(model, row, primary_field))
+                rows += 1
+
+        db.session.remove()
+        return number, rows
+
+
+def reindex(app, model, procs=4, partitions=None, restart=False, log=None):
+    ''' Rebuild the whole index of ``model``.
+
+    The primary key range is cut into partitions that worker processes index
+    into separate segments, which are then merged into the live index in one
+    commit that replaces its old contents. Finished partitions are checkpointed
+    so an interrupted run picks up where it stopped unless ``restart`` is set.
+    Returns the number of rows indexed. '''
+
+    global _reindex_app, _reindex_model
+
+    log = log or (lambda message: None)
+    checkpoint_path = _state_path(app, model, 'checkpoint')
+    build_dir = _state_path(app, model, 'partitions')
+    primary_field = _get_primary_key_name(model)
+
+    checkpoint = None if restart else _load_state(checkpoint_path, None)
+    if checkpoint is None:
+        if os.path.exists(build_dir):
+            shutil.rmtree(build_dir)
+        checkpoint = {
+            'started': _now(),
+            'partitions': _partitions(model, primary_field, partitions or procs * 4),
+            'done': {},
+        }
+        _save_state(checkpoint_path, checkpoint)
+    else:
+        log('resuming, {0} of {1} partitions already built'.format(
+            len(checkpoint['done']), len(checkpoint['partitions'])))
+
+    todo = [(number, start, stop, os.path.join(build_dir, str(number)))
+            for number, (start, stop) in enumerate(checkpoint['partitions'])
+            if str(number) not in checkpoint['done']]
+
+    if todo:
+        _reindex_app, _reindex_model = app, model
+        pool = multiprocessing.Pool(min(procs, len(todo)))
+        try:
+            for number, rows in pool.imap_unordered(_build_partition, todo):
+                checkpoint['done'][str(number)] = rows
+                _save_state(checkpoint_path, checkpoint)
+                log('partition {0} done, {1} rows ({2}/{3})'.format(
+                    number, rows, len(checkpoint['done']), len(checkpoint['partitions'])))
+        finally:
+            pool.close()
+            pool.join()
+
+    indx = whoosh_index(app, model)
+    with indx.writer(timeout=app.config.get('WHOOSH_WRITER_TIMEOUT', 60)) as writer:
+        writer.mergetype = whoosh.writing.CLEAR
+        for number in range(len(checkpoint['partitions'])):
+            writer.add_reader(whoosh.index.open_dir(
+                os.path.join(build_dir, str(number))).reader())
+
+    # Anything that changed while we were running is picked up incrementally
+    _save_state(_state_path(app, model, 'watermark'), checkpoint['started'])
+    os.remove(checkpoint_path)
+    shutil.rmtree(build_dir, ignore_errors=True)
+
+    total = sum(checkpoint['done'].values())
+    log('indexed {0} rows'.format(total))
+    return total
+
+
+def reindex_incremental(app, model, log=None):
+    ''' Reindex the rows of ``model`` updated since the last watermark, which
+    is the start time of the previous full or incremental run. '''
+
+    log = log or (lambda message: None)
+    watermark_path = _state_path(app, model, 'watermark')
+    watermark = _load_state(watermark_path, None)
+    if watermark is None:
+        raise ValueError('{0} has no watermark yet, run a full reindex first'
+                .format(model.__name__))
+    if not hasattr(model, 'last_update_time'):
+        raise ValueError('{0} has no last_update_time to compare against'
+                .format(model.__name__))
+
+    started = _now()
+    primary_field = _get_primary_key_name(model)
+    query = model.query.with_entities(getattr(model, primary_field)).filter(
+        model.last_update_time >= datetime.datetime.strptime(watermark, WATERMARK_FORMAT))
+    keys = [unicode(row[0]) for row in query]
+
+    if keys:
+        _index_keys(app, model, keys)
+    _save_state(watermark_path, started)
+
+    log('reindexed {0} rows updated since {1}'.format(len(keys), watermark))
+    return len(keys)
+
+
+WATERMARK_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def _now():
+    return datetime.datetime.utcnow().strftime(WATERMARK_FORMAT)
 
 
 flask_sqlalchemy.models_committed.connect(_after_flush)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Blacklist tests."""
+import pytest
+
+from recruit_app.blacklist.managers import BlacklistManager
+from recruit_app.blacklist.models import BlacklistCharacter
+
+
+class TestIpLookupKeys:
+    """Candidate keys for an address."""
+
+    def test_includes_address_and_prefixes(self):
+        keys = BlacklistManager.ip_lookup_keys('10.1.2.3')
+        assert '10.1.2.3' in keys
+        assert '10.1.' in keys
+
+    def test_includes_ipv4_networks(self):
+        keys = BlacklistManager.ip_lookup_keys('10.1.2.3')
+        assert '10.0.0.0/8' in keys
+        assert '10.1.2.0/24' in keys
+        assert '10.1.2.3/32' in keys
+        assert '0.0.0.0/0' in keys
+
+    def test_ipv6_gets_prefixes_only(self):
+        keys = BlacklistManager.ip_lookup_keys('2001:db8::1')
+        assert '2001:db8::1' in keys
+        assert '2001:db8:' in keys
+        assert not any('/' in key for key in keys)
+
+
+@pytest.mark.usefixtures('db')
+class TestFindBlacklistedIps:
+    """Blacklist IP matching."""
+
+    def test_matches_exact_prefix_and_cidr_entries(self):
+        for ip_address in (u'192.168.1.10', u'172.16.', u'10.0.0.0/8'):
+            BlacklistCharacter(name=u'bad', notes=u'', ip_address=ip_address).save()
+
+        ips = ['192.168.1.10', '172.16.5.5', '10.20.30.40', '8.8.8.8']
+        assert BlacklistManager.find_blacklisted_ips(ips) == ['10.20.30.40', '172.16.5.5', '192.168.1.10']
+
+    def test_no_match(self):
+        BlacklistCharacter(name=u'bad', notes=u'', ip_address=u'192.168.1.10').save()
+        assert BlacklistManager.find_blacklisted_ips(['192.168.1.1', None]) == []
@@ -4,6 +4,7 @@ import datetime as dt
 
 import pytest
 
+from recruit_app.database import after_commit, in_unit_of_work, unit_of_work
 from recruit_app.user.models import Role, User
 
 from .factories import UserFactory
@@ -59,3 +60,63 @@ class TestUser:
         user.roles.append(role)
         user.save()
         assert role in user.roles
+
+
+@pytest.mark.usefixtures('db')
+class TestUnitOfWork:
+    """Unit of work tests."""
+
+    def test_saves_commit_once_on_exit(self, db):
+        """Saves inside the block are flushed, then committed together."""
+        with unit_of_work():
+            user = User(email='foo@bar.com')
+            user.save()
+            assert user.id is not None
+            assert in_unit_of_work() is True
+        assert in_unit_of_work() is False
+        db.session.expire_all()
+        assert User.query.filter_by(email='foo@bar.com').count() == 1
+
+    def test_rolls_back_on_error(self):
+        """Nothing is kept when the block raises."""
+        with pytest.raises(RuntimeError):
+            with unit_of_work():
+                User(email='foo@bar.com').save()
+                raise RuntimeError()
+        assert User.query.filter_by(email='foo@bar.com').count() == 0
+
+    def test_nested_blocks_join_the_outer_one(self):
+        """An inner block does not commit on its own."""
+        with pytest.raises(RuntimeError):
+            with unit_of_work():
+                with unit_of_work():
+                    User(email='foo@bar.com').save()
+                raise RuntimeError()
+        assert User.query.filter_by(email='foo@bar.com').count() == 0
+
+    def test_after_commit_waits_for_the_outer_commit(self):
+        """Callbacks run after the outermost commit and are dropped on rollback."""
+        calls = []
+        with unit_of_work():
+            with unit_of_work():
+                after_commit(lambda: calls.append('committed'))
+            assert calls == []
+        assert calls == ['committed']
+
+        with pytest.raises(RuntimeError):
+            with unit_of_work():
+                after_commit(lambda: calls.append('rolled back'))
+                raise RuntimeError()
+        assert calls == ['committed']
+
+    def test_failing_after_commit_callback_does_not_stop_the_rest(self):
+        """A raising callback is logged, the ones after it still run."""
+        calls = []
+
+        def fail():
+            raise RuntimeError()
+
+        with unit_of_work():
+            after_commit(fail)
+            after_commit(lambda: calls.append('ran'))
+        assert calls == ['ran']
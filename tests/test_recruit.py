@@ -0,0 +1,590 @@
+# -*- coding: utf-8 -*-
+"""Recruitment tests."""
+import datetime as dt
+
+import pytest
+from flask import url_for
+from flask_rq import get_connection, get_queue
+from rq_scheduler import Scheduler
+from sqlalchemy import event, func
+
+import redone_search
+import whoosh.writing
+
+from recruit_app import bm25, fulltext
+from recruit_app.blacklist.models import BlacklistCharacter, BlacklistGSF
+from recruit_app.database import KeysetPagination, decode_cursor, encode_cursor, unit_of_work
+from recruit_app.recruit.counters import ApplicationCounterManager
+from recruit_app.recruit.dossier import DossierManager
+from recruit_app.recruit.involvement import InvolvementManager
+from recruit_app.recruit.managers import RecruitManager
+from recruit_app.recruit.models import HrApplication, HrApplicationComment, HrApplicationSignature
+from recruit_app.recruit.similarity import SimilarityManager
+from recruit_app.recruit.slack import SlackManager
+from recruit_app.recruit.tasks import sign_application
+from recruit_app.recruit.views import cached_total
+from recruit_app.user.models import EveAllianceInfo, EveApiKeyPair, EveCharacter, EveCorporationInfo, Role, User
+
+from .factories import UserFactory
+
+THESIS = u'I have been mining in high sec for three years and want to try null sec with friends'
+RECRUITER_EMAIL = 'recruiter@example.com'
+
+
+def make_application(db, characters, comments):
+    alliance = EveAllianceInfo(alliance_id='1', alliance_name='Alliance', alliance_ticker='ALLY').save()
+    corporation = EveCorporationInfo(corporation_id='2', corporation_name='Corp', corporation_ticker='CORP',
+                                     alliance_id=alliance.alliance_id).save()
+
+    applicant = UserFactory(last_login_ip='10.0.0.1', current_login_ip='10.0.0.2')
+    recruiter = UserFactory(email=RECRUITER_EMAIL, confirmed_at=dt.datetime.utcnow())
+    recruiter.roles.append(Role(name='recruiter'))
+    db.session.commit()
+
+    EveCharacter(character_id='99', character_name='Recruiter', user_id=recruiter.id).save()
+    recruiter.main_character_id = '99'
+    recruiter.save()
+
+    application = HrApplication(user_id=applicant.id, thesis=THESIS).save()
+    HrApplication(user_id=applicant.id, approved_denied='Rejected').save()
+    add_characters(db, application.id, 0, characters)
+    add_comments(db, application.id, comments)
+    return application.id
+
+
+def add_characters(db, application_id, start, count):
+    """Characters for the applicant, all of them applied with the applicant's other application."""
+    application = HrApplication.query.get(application_id)
+    related = HrApplication.query.filter(HrApplication.user_id == application.user_id,
+                                         HrApplication.id != application_id).one()
+    for i in range(start, start + count):
+        character = EveCharacter(character_id=str(100 + i), character_name='Pilot {0}'.format(i),
+                                 corporation_id='2', user_id=application.user_id).save()
+        BlacklistGSF(character_id=str(100 + i), status=u'NOT FOUND').save()
+        related.characters.append(character)
+    related.save()
+
+
+def add_comments(db, application_id, count):
+    recruiter = User.query.filter_by(email=RECRUITER_EMAIL).one()
+    for i in range(count):
+        HrApplicationComment(application_id=application_id, user_id=recruiter.id, comment=u'Comment').save()
+
+
+def add_similar(db, application_id, count):
+    """Near duplicate applications from other applicants, everything signed. Returns their names."""
+    names = []
+    for i in range(count):
+        copycat = UserFactory().save()
+        names.append(u'Copycat {0}'.format(copycat.id))
+        HrApplication(user_id=copycat.id, main_character_name=names[-1], thesis=THESIS).save()
+    for application in HrApplication.query.filter(HrApplication.thesis == THESIS):
+        SimilarityManager.record(application)
+    db.session.commit()
+    return names
+
+
+def count_dossier_queries(db, application_id):
+    db.session.expire_all()
+    application = HrApplication.query.get(application_id)
+    application.user
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        dossier = DossierManager.build(application)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return dossier, len(statements)
+
+
+def log_in(testapp, email):
+    res = testapp.get('/')
+    form = res.forms['loginForm']
+    form['email'] = email
+    form['password'] = 'example'
+    form.submit()
+
+
+def count_page_queries(db, testapp, application_id):
+    # A new dossier version and an empty session, so nothing comes from the cache or the identity map
+    DossierManager.invalidate_user(HrApplication.query.get(application_id).user_id)
+    db.session.commit()
+    db.session.remove()
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        res = testapp.get(url_for('recruit.application_view', application_id=application_id))
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return res, len(statements)
+
+
+class TestDossierQueries:
+    """Building an application dossier."""
+
+    # One query each for current and previous characters, related applications and
+    # their characters, comments, api keys, GSF statuses and both blacklists
+    MAX_QUERIES = 9
+
+    @pytest.mark.parametrize('characters, comments', [(1, 1), (12, 15)])
+    def test_query_count_is_bounded(self, db, characters, comments):
+        """Query count doesn't depend on how many characters or comments there are."""
+        dossier, queries = count_dossier_queries(db, make_application(db, characters, comments))
+        assert len(dossier['characters']) == characters
+        assert len(dossier['comments']) == comments
+        assert len(dossier['related']) == 1
+        assert len(dossier['related'][0]['characters']) == characters
+        assert dossier['characters'][0]['corporation']['alliance']['alliance_name'] == 'Alliance'
+        assert dossier['comments'][0]['user']['main_character'] == 'Recruiter'
+        assert queries <= self.MAX_QUERIES
+
+    def test_page_query_count_is_bounded(self, db, testapp):
+        """The application page takes as many queries with many characters, comments and similar apps as with one."""
+        application_id = make_application(db, 1, 1)
+        similar = add_similar(db, application_id, 1)
+        log_in(testapp, RECRUITER_EMAIL)
+        res, few = count_page_queries(db, testapp, application_id)
+        assert res.status_code == 200
+        assert 'Pilot 0' in res
+        assert all(name in res for name in similar)
+
+        add_characters(db, application_id, 1, 11)
+        add_comments(db, application_id, 14)
+        similar += add_similar(db, application_id, 3)
+        res, many = count_page_queries(db, testapp, application_id)
+        assert 'Pilot 11' in res
+        assert all(name in res for name in similar)
+        assert many == few
+
+
+@pytest.mark.usefixtures('db')
+class TestDossierInvalidation:
+    """Dossier version bumps."""
+
+    def test_bump_waits_for_commit(self):
+        """Inside a unit of work the version only moves once the transaction commits."""
+        key = 'dossier:version:user:0'
+        connection = get_connection()
+        connection.delete(key)
+        with unit_of_work():
+            DossierManager.invalidate_user(0)
+            assert connection.get(key) is None
+        assert connection.get(key) == '1'
+
+
+@pytest.mark.usefixtures('db')
+class TestSearchApplications:
+    """Trigram application search."""
+
+    def test_matches_main_and_applicant_characters_best_first(self):
+        """Applicant characters match too, closer names rank first."""
+        applicant = UserFactory().save()
+        other = UserFactory().save()
+        HrApplication(user_id=other.id, main_character_name=u'Someone Else').save()
+        by_alt = HrApplication(user_id=applicant.id, main_character_name=u'Main Pilot').save()
+        EveCharacter(character_id='1', character_name='Alt Harkonnen', user_id=applicant.id).save()
+        by_main = HrApplication(user_id=other.id, main_character_name=u'Harkonnen').save()
+
+        results = RecruitManager.search_applications('harkonnen').all()
+        assert [app.id for app in results] == [by_main.id, by_alt.id]
+
+    def test_escapes_like_wildcards(self):
+        """LIKE wildcards in the term are matched literally."""
+        HrApplication(user_id=UserFactory().save().id, main_character_name=u'Plain Name').save()
+        assert RecruitManager.search_applications('%').all() == []
+
+
+@pytest.mark.usefixtures('db')
+class TestSearchIndexQueue:
+    """Whoosh indexing handed to the rq workers."""
+
+    def test_commits_queue_one_index_job(self):
+        """Committed applications are noted as pending and share one queued job."""
+        connection = get_connection()
+        connection.delete(redone_search.PENDING_KEY.format('HrApplication'),
+                          redone_search.SCHEDULED_KEY.format('HrApplication'))
+        queue = get_queue('low')
+        queue.empty()
+
+        first = HrApplication(thesis=u'First').save()
+        second = HrApplication(thesis=u'Second').save()
+
+        assert connection.smembers(redone_search.PENDING_KEY.format('HrApplication')) == \
+            set([str(first.id), str(second.id)])
+        assert [job.func_name for job in queue.jobs] == ['redone_search.index_pending']
+        assert queue.jobs[0].args == ('HrApplication',)
+
+
+@pytest.mark.usefixtures('db')
+class TestWhooshSearch:
+    """Ranked Whoosh search over applications."""
+
+    def test_results_are_ranked_and_paginated(self, app):
+        """Hits come back best first as an ordinary query that can be paginated."""
+        index = redone_search.whoosh_index(app, HrApplication)
+        index.writer().commit(mergetype=whoosh.writing.CLEAR)
+
+        strong = HrApplication(thesis=u'miner miner miner').save()
+        weak = HrApplication(thesis=u'miner and pvp pilot, happy to fly logistics or tackle in fleets').save()
+        other = HrApplication(thesis=u'pvp pilot').save()
+        redone_search._index_keys(app, HrApplication, [strong.id, weak.id, other.id])
+
+        query = HrApplication.query.whoosh_search(u'miner')
+        assert [application.id for application in query] == [strong.id, weak.id]
+
+        page = query.paginate(2, 1, False)
+        assert [application.id for application in page.items] == [weak.id]
+        assert page.total == 2
+
+
+@pytest.mark.usefixtures('db')
+class TestKeysetPagination:
+    """Seek pagination over applications."""
+
+    def make_queue(self):
+        user = UserFactory().save()
+        for i in range(5):
+            HrApplication(user_id=user.id, training=(i % 2 == 0)).save()
+        return [(func.coalesce(HrApplication.training, False), True), (HrApplication.id, False)], \
+            lambda app: (bool(app.training), app.id)
+
+    def test_walks_forward_and_back(self):
+        """Cursors visit every row once in (training, id) order and lead back again."""
+        keys, values = self.make_queue()
+        first = KeysetPagination(HrApplication.query, keys, values, 2)
+        second = KeysetPagination(HrApplication.query, keys, values, 2, after=first.next_cursor)
+        last = KeysetPagination(HrApplication.query, keys, values, 2, after=second.next_cursor)
+        back = KeysetPagination(HrApplication.query, keys, values, 2, before=last.prev_cursor)
+
+        walked = [values(app) for page in (first, second, last) for app in page.items]
+        assert walked == sorted(walked, key=lambda key: (not key[0], key[1]))
+        assert len(walked) == 5
+        assert first.prev_cursor is None
+        assert last.next_cursor is None
+        assert [app.id for app in back.items] == [app.id for app in second.items]
+
+    def test_bad_cursor_starts_at_first_page(self):
+        """A tampered cursor falls back to page one."""
+        keys, values = self.make_queue()
+        first = KeysetPagination(HrApplication.query, keys, values, 2)
+        assert [app.id for app in KeysetPagination(HrApplication.query, keys, values, 2, after='bogus').items] == \
+            [app.id for app in first.items]
+
+    @pytest.mark.parametrize('values', [['yes', 1], [True, '1'], [True, {'id': 1}], [1, True], [True, False]])
+    def test_cursor_values_must_match_key_types(self, values):
+        """Well formed tokens carrying the wrong types are ignored rather than sent to SQL."""
+        keys, _ = self.make_queue()
+        assert decode_cursor(encode_cursor(values), keys) is None
+        assert decode_cursor(encode_cursor([True, 1]), keys) == [True, 1]
+
+    def test_total_is_cached_in_redis(self):
+        """The queue total is counted once and then served from Redis."""
+        get_connection().delete('application_queue_total:test')
+        self.make_queue()
+        assert cached_total('application_queue_total:test', HrApplication.query) == 5
+        HrApplication().save()
+        assert cached_total('application_queue_total:test', HrApplication.query) == 5
+
+
+@pytest.mark.usefixtures('db')
+class TestApplicationCounters:
+    """Per status application counters."""
+
+    def test_reconcile_counts_every_application(self):
+        """Reconcile rebuilds the counters from the applications table."""
+        user = UserFactory().save()
+        HrApplication(user_id=user.id).save()
+        HrApplication(user_id=user.id, training=True).save()
+        HrApplication(user_id=user.id, approved_denied='Approved').save()
+        HrApplication(user_id=user.id, hidden=True).save()
+
+        ApplicationCounterManager.reconcile()
+        assert ApplicationCounterManager.status_counts() == {'New': 2, 'Approved': 1}
+        assert ApplicationCounterManager.status_counts(hidden=True) == {'New': 1}
+        assert ApplicationCounterManager.open_count() == 2
+        assert ApplicationCounterManager.training_count() == 1
+
+    def test_alter_application_moves_its_count(self):
+        """Status and hidden changes move the application between counters."""
+        user = UserFactory().save()
+        application = HrApplication(user_id=user.id).save()
+        ApplicationCounterManager.reconcile()
+
+        RecruitManager.alter_application(application, 'approve', user)
+        assert ApplicationCounterManager.status_counts() == {'New': 0, 'Approved': 1}
+        RecruitManager.alter_application(application, 'hide', user)
+        assert ApplicationCounterManager.status_counts(hidden=True) == {'Approved': 1}
+
+
+@pytest.mark.usefixtures('db')
+class TestInvolvement:
+    """The my applications index."""
+
+    def test_comments_and_actions_are_recorded(self):
+        """Commenting on or acting on an application indexes it for the recruiter."""
+        applicant = UserFactory().save()
+        recruiter = UserFactory().save()
+        commented = HrApplication(user_id=applicant.id).save()
+        acted_on = HrApplication(user_id=applicant.id).save()
+        HrApplication(user_id=applicant.id).save()
+
+        RecruitManager.create_comment(commented, u'Looks fine', recruiter)
+        RecruitManager.alter_application(acted_on, 'undecided', recruiter)
+
+        results = InvolvementManager.applications_query(recruiter.id).order_by(HrApplication.id).all()
+        assert [app.id for app in results] == [commented.id, acted_on.id]
+
+    def test_rebuild_matches_history(self):
+        """Rebuild picks up existing comments and reviewers."""
+        applicant = UserFactory().save()
+        recruiter = UserFactory().save()
+        application = HrApplication(user_id=applicant.id, reviewer_user_id=recruiter.id).save()
+        HrApplicationComment(application_id=application.id, user_id=applicant.id, comment=u'Hi').save()
+
+        InvolvementManager.rebuild()
+        assert [app.id for app in InvolvementManager.applications_query(recruiter.id)] == [application.id]
+        assert [app.id for app in InvolvementManager.applications_query(applicant.id)] == [application.id]
+
+    def test_rebuild_keeps_recorded_actions(self):
+        """Actions the application no longer shows, like a training toggle, survive a rebuild."""
+        applicant = UserFactory().save()
+        recruiter = UserFactory().save()
+        other = UserFactory().save()
+        toggled = HrApplication(user_id=applicant.id).save()
+        overwritten = HrApplication(user_id=applicant.id).save()
+
+        RecruitManager.alter_application(toggled, 'training', recruiter)
+        RecruitManager.alter_application(overwritten, 'undecided', recruiter)
+        RecruitManager.alter_application(overwritten, 'undecided', other)
+
+        InvolvementManager.rebuild()
+        results = InvolvementManager.applications_query(recruiter.id).order_by(HrApplication.id).all()
+        assert [app.id for app in results] == [toggled.id, overwritten.id]
+
+
+class FormStub(object):
+    """Just enough of HrApplicationForm for RecruitManager.create_application."""
+
+    class Field(object):
+        def __init__(self, data):
+            self.data = data
+
+    def __init__(self, **data):
+        self._data = data
+
+    def __getattr__(self, name):
+        return FormStub.Field(self._data.get(name))
+
+
+class TestCreateApplication:
+    """Submitting an application."""
+
+    def test_submission_commits_once(self, db):
+        """Application, characters and starter comment go out in a single commit."""
+        applicant = UserFactory().save()
+        EveApiKeyPair(api_id='42', api_key='secret', user_id=applicant.id).save()
+        for i in range(3):
+            EveCharacter(character_id=str(200 + i), character_name='Alt {0}'.format(i), api_id='42',
+                         user_id=applicant.id).save()
+        applicant.main_character_id = '200'
+        applicant.save()
+
+        commits = []
+        record = lambda conn: commits.append(conn)
+        event.listen(db.engine, 'commit', record)
+        try:
+            application = RecruitManager.create_application(
+                FormStub(thesis=u'Hello', alt_application=False, characters=['200', '201']), applicant)
+        finally:
+            event.remove(db.engine, 'commit', record)
+
+        assert len(commits) == 1
+        assert sorted(character.character_id for character in application.characters) == ['200', '201']
+        assert application.main_character_name == 'Alt 0'
+        comment = HrApplicationComment.query.filter_by(application_id=application.id).one()
+        assert '42\n\n- Alt 0\n- Alt 1\n- Alt 2\n' in comment.comment
+
+
+@pytest.mark.usefixtures('db')
+class TestSimilarity:
+    """Near duplicate application detection."""
+
+    thesis = u' '.join(u'I have been flying in null sec for {0} years and want to join'.format(i) for i in range(20))
+
+    def test_copied_answers_are_found(self):
+        """Another applicant's copied thesis matches, unrelated text does not."""
+        original = HrApplication(user_id=UserFactory().save().id, thesis=self.thesis).save()
+        copy = HrApplication(user_id=UserFactory().save().id, thesis=self.thesis + u' Thanks!').save()
+        unrelated = HrApplication(user_id=UserFactory().save().id,
+                                  thesis=u'Industrialist looking for a quiet corner of high sec to build ships').save()
+        for application in (original, copy, unrelated):
+            SimilarityManager.record(application)
+
+        matches = SimilarityManager.similar_applications(copy)
+        assert [application.id for application, _ in matches] == [original.id]
+        assert matches[0][1] > 0.8
+        assert SimilarityManager.similar_applications(unrelated) == []
+
+    def test_sign_application_job(self):
+        """The job queued after submission stores the signature."""
+        application = HrApplication(user_id=UserFactory().save().id, thesis=self.thesis).save()
+        sign_application(application.id)
+        assert HrApplicationSignature.query.get(application.id) is not None
+
+    def test_rebuild_skips_signed_applications(self):
+        """Rebuild only signs applications without a signature."""
+        HrApplication(user_id=UserFactory().save().id, thesis=self.thesis).save()
+        HrApplication(user_id=UserFactory().save().id).save()
+
+        assert SimilarityManager.rebuild() == 1
+        assert SimilarityManager.rebuild() == 0
+
+
+class TestSlackNotifications:
+    """Queued Slack notifications."""
+
+    @pytest.fixture
+    def scheduled(self, app, monkeypatch):
+        """Application ids sends were scheduled for, without leaving jobs in rq-scheduler."""
+        app.config['SLACK_WEBHOOK'] = 'https://hooks.slack.invalid/test'
+        for application_id in (1, 2):
+            SlackManager.take(application_id)
+        calls = []
+        monkeypatch.setattr(Scheduler, 'enqueue_in',
+                            lambda scheduler, delta, func, application_id: calls.append(application_id))
+        return calls
+
+    def test_messages_are_coalesced_per_channel(self, scheduled):
+        """Mentions and status changes queued together go out as one message per channel."""
+        SlackManager.notify(1, u'Needs processing')
+        SlackManager.notify(1, u'Needs director review')
+        SlackManager.notify(1, u'Mentioned', '@recruiter')
+        SlackManager.notify(1, u'Mentioned', '@recruiter')
+        SlackManager.notify(2, u'Other application')
+
+        assert scheduled == [1, 2]
+        assert SlackManager.take(1) == {None: u'Needs processing\nNeeds director review',
+                                        '@recruiter': u'Mentioned'}
+        assert SlackManager.take(1) == {}
+        assert SlackManager.take(2) == {None: u'Other application'}
+
+    def test_message_after_drain_schedules_a_new_send(self, scheduled):
+        """A message queued after the send took the batch isn't left waiting."""
+        SlackManager.notify(1, u'First')
+        SlackManager.take(1)
+        SlackManager.notify(1, u'Second')
+
+        assert scheduled == [1, 1]
+        assert SlackManager.take(1) == {None: u'Second'}
+
+
+@pytest.mark.skipif(bm25.numpy is None, reason='numpy is not installed')
+class TestBM25Index:
+    """The in-process full text index."""
+
+    documents = [(0, 1, u'Miner from Brave looking for null sec'),
+                 (0, 2, u'PvP pilot and fleet commander'),
+                 (0, 3, u'miner miner miner'),
+                 (1, 1, u'Known spy, stole from a miner')]
+
+    def test_ranks_by_term_frequency(self):
+        """The document repeating the term ranks first, kinds are kept apart."""
+        index = bm25.BM25Index(bm25.Segment.build(self.documents))
+        assert [key for _, key, _ in index.search(u'miner', kind=0)] == [3, 1]
+        assert [key for _, key, _ in index.search(u'miner', kind=1)] == [1]
+
+    def test_delta_replaces_saved_document(self, tmpdir):
+        """A reloaded index finds the updated text instead of the old one."""
+        path = str(tmpdir.join('index'))
+        bm25.BM25Index(bm25.Segment.build(self.documents), 'watermark').save(path)
+
+        index = bm25.BM25Index.load(path)
+        assert index.watermark == 'watermark'
+        index.update([(0, 3, u'now a fleet commander')])
+        assert [key for _, key, _ in index.search(u'miner', kind=0)] == [1]
+        assert sorted(key for _, key, _ in index.search(u'fleet', kind=0)) == [2, 3]
+
+    def test_updates_accumulate(self):
+        """Each update only carries the newest changes, earlier ones stay in the delta."""
+        index = bm25.BM25Index(bm25.Segment.build(self.documents))
+        index.update([(0, 3, u'now a fleet commander')])
+        index.update([(0, 1, u'logistics pilot')])
+        assert [key for _, key, _ in index.search(u'miner', kind=0)] == []
+        assert sorted(key for _, key, _ in index.search(u'fleet', kind=0)) == [2, 3]
+        assert [key for _, key, _ in index.search(u'logistics', kind=0)] == [1]
+
+
+@pytest.mark.skipif(bm25.numpy is None, reason='numpy is not installed')
+@pytest.mark.usefixtures('db')
+class TestFullText:
+    """BM25 search over applications and the blacklist."""
+
+    @pytest.fixture
+    def index_path(self, app, tmpdir, monkeypatch):
+        # A fresh engine per test, the module keeps one per process
+        monkeypatch.setitem(app.config, 'BM25_INDEX_PATH', str(tmpdir.join('index')))
+        monkeypatch.setitem(app.config, 'BM25_REFRESH_INTERVAL', 0)
+        monkeypatch.setattr(fulltext, '_engine', {'index': None, 'mtime': None, 'since': None,
+                                                  'refreshed': 0, 'refreshing': False})
+        return app.config['BM25_INDEX_PATH']
+
+    def test_documents_since(self):
+        """Only rows changed since the given time come back, with the applied character names."""
+        applicant = UserFactory().save()
+        HrApplication(user_id=applicant.id, thesis=u'Old app', last_update_time=dt.datetime(2015, 1, 1)).save()
+        new = HrApplication(user_id=applicant.id, thesis=u'New app').save()
+        character = EveCharacter(character_id='300', character_name='Pilot', user_id=applicant.id).save()
+        new.characters.append(character)
+        new.save()
+        BlacklistCharacter(name=u'Spy', last_update_time=dt.datetime(2015, 1, 1)).save()
+
+        documents = list(fulltext.FullTextManager.documents(dt.datetime(2016, 1, 1)))
+        assert [(kind, key) for kind, key, _ in documents] == [(fulltext.APPLICATION, new.id)]
+        assert u'Pilot' in documents[0][2]
+        assert len(list(fulltext.FullTextManager.documents())) == 3
+
+    def test_renamed_character_reindexes_application(self, db):
+        """Renaming an applied character puts the unchanged application in the delta."""
+        applicant = UserFactory().save()
+        application = HrApplication(user_id=applicant.id, thesis=u'Hello',
+                                    last_update_time=dt.datetime(2015, 1, 1)).save()
+        character = EveCharacter(character_id='301', character_name='Before', user_id=applicant.id).save()
+        application.characters.append(character)
+        db.session.execute(HrApplication.__table__.update().where(HrApplication.id == application.id).values(
+            last_update_time=dt.datetime(2015, 1, 1)))
+        db.session.commit()
+
+        since = dt.datetime.utcnow()
+        character.character_name = 'After'
+        character.save()
+
+        documents = list(fulltext.FullTextManager.documents(since))
+        assert [(kind, key) for kind, key, _ in documents] == [(fulltext.APPLICATION, application.id)]
+        assert u'After' in documents[0][2]
+
+    def test_search_query_keeps_rank_order(self, index_path):
+        """Results come back best match first, and later changes show up without a rebuild."""
+        applicant = UserFactory().save()
+        once = HrApplication(user_id=applicant.id, thesis=u'I like mining').save()
+        twice = HrApplication(user_id=applicant.id, thesis=u'Mining, mining and more mining').save()
+        HrApplication(user_id=applicant.id, thesis=u'Fleet commander').save()
+        assert fulltext.FullTextManager.rebuild() == 3
+
+        query = fulltext.FullTextManager.search_query(HrApplication, fulltext.APPLICATION, u'mining')
+        assert [app.id for app in query] == [twice.id, once.id]
+
+        once.thesis = u'Mining mining mining mining mining'
+        once.save()
+        query = fulltext.FullTextManager.search_query(HrApplication, fulltext.APPLICATION, u'mining')
+        assert [app.id for app in query] == [once.id, twice.id]
+        assert fulltext.FullTextManager.search_query(HrApplication, fulltext.APPLICATION, u'nothing').all() == []
@@ -15,6 +15,6 @@ if __name__ == '__main__':
             print 'Please specific corp, api_key, or all.'
             sys.exit()
         if sys.argv[1] == 'corp' or sys.argv[1] == 'all':
-            run_alliance_corp_update()
+            run_alliance_corp_update(inline=True)
         if sys.argv[1] == 'api_key' or sys.argv[1] == 'all':
-            run_api_key_update()
+            run_api_key_update(inline=True)